@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks for the hot paths of sqlitecli.
+
+Synthetic databases are generated in a temporary directory, and the time
+taken by statement splitting, execution, rendering (per table format),
+completion (per suggestion type) and starting the client is measured. The
+results are printed as JSON, so that they can be saved and compared between
+releases:
+
+    $ python benchmarks/benchmark.py -o before.json
+    $ python benchmarks/benchmark.py -o after.json --compare before.json
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.document import Document  # noqa: E402
+import sqlparse  # noqa: E402
+
+from sqlitecli import __version__  # noqa: E402
+from sqlitecli.completion_refresher import CompletionRefresher  # noqa: E402
+from sqlitecli.main import SQLiteCli  # noqa: E402
+from sqlitecli.packages.parseutils import iter_statements  # noqa: E402
+from sqlitecli.sqlcompleter import SQLCompleter  # noqa: E402
+from sqlitecli.sqlexecute import SQLExecute  # noqa: E402
+
+TABLE_FORMATS = ('ascii', 'psql', 'csv', 'tsv', 'vertical', 'sql-insert')
+
+# Documents whose completions are measured, keyed by suggestion type.
+COMPLETIONS = (
+    ('keyword', 'SEL'),
+    ('table', 'SELECT * FROM t01'),
+    ('column', 'SELECT c0 FROM wide WHERE c1'),
+    ('function', 'SELECT co'),
+    ('join', 'SELECT * FROM t0001 a JOIN t0002 b ON a.'),
+    ('special', '\\'),
+)
+
+
+def create_databases(directory, scale):
+    """Create the synthetic databases and return their paths by name."""
+    paths = {}
+
+    def create(name, statements):
+        path = paths[name] = os.path.join(directory, name + '.db')
+        conn = sqlite3.connect(path)
+        with conn:
+            for statement, rows in statements:
+                if rows is None:
+                    conn.execute(statement)
+                else:
+                    conn.executemany(statement, rows)
+        conn.close()
+
+    columns = 200
+    create('wide', [
+        ('CREATE TABLE wide ({0})'.format(
+            ', '.join('c{0} INTEGER'.format(i) for i in range(columns))),
+         None),
+        ('INSERT INTO wide VALUES ({0})'.format(', '.join('?' * columns)),
+         ([i * j for j in range(columns)] for i in range(20 * scale))),
+    ])
+
+    create('many', [
+        ('CREATE TABLE t{0:04d} (id INTEGER PRIMARY KEY, {1})'.format(
+            i, ', '.join('col{0}_{1} TEXT'.format(i, j) for j in range(10))),
+         None)
+        for i in range(20 * scale)])
+
+    create('long', [
+        ('CREATE TABLE long (id INTEGER, name TEXT, price REAL, note TEXT)',
+         None),
+        ('INSERT INTO long VALUES (?, ?, ?, ?)',
+         ((i, 'name {0}'.format(i), i / 7.0, 'x' * (i % 200))
+          for i in range(500 * scale))),
+    ])
+
+    create('unicode', [
+        ('CREATE TABLE unicode (id INTEGER, word TEXT)', None),
+        ('INSERT INTO unicode VALUES (?, ?)',
+         ((i, 'ünïcödé 文字 {0}'.format(i)) for i in range(500 * scale))),
+    ])
+    return paths
+
+
+def measure(name, func, repeat, results):
+    """Time *func* and add the result to *results*."""
+    func()  # Warm up caches.
+    times = sorted(timeit.repeat(func, number=1, repeat=repeat))
+    results.append({'name': name, 'min': times[0],
+                    'median': times[len(times) // 2], 'repeat': repeat})
+    print('{0:<40} {1:>10.6f}s'.format(name, times[0]), file=sys.stderr)
+
+
+def consume(results):
+    for _, cur, _, _ in results:
+        if cur is not None:
+            for _ in cur:
+                pass
+
+
+def bench_split(scale, repeat, results):
+    script = ''.join(
+        "INSERT INTO t VALUES ({0}, 'a;b', \"c\"); -- ;\n".format(i)
+        for i in range(50 * scale))
+    lines = script.splitlines(True)
+    measure('split/iter_statements', lambda: list(iter_statements(lines)),
+            repeat, results)
+    measure('split/sqlparse', lambda: sqlparse.split(script), repeat, results)
+
+
+def bench_execute(paths, repeat, results):
+    queries = (
+        ('wide', 'SELECT * FROM wide'),
+        ('long', 'SELECT * FROM long'),
+        ('long', 'SELECT count(*), sum(price) FROM long GROUP BY id % 10'),
+        ('unicode', 'SELECT * FROM unicode'),
+    )
+    for name, query in queries:
+        executor = SQLExecute(paths[name])
+        measure('execute/{0}/{1}'.format(name, query),
+                lambda: consume(executor.run(query)), repeat, results)
+
+
+def bench_render(paths, repeat, results):
+    sqlitecli = SQLiteCli(sqliteclirc=os.devnull)
+    for name in ('wide', 'long', 'unicode'):
+        sqlitecli.connect(paths[name])
+        query = 'SELECT * FROM {0}'.format(name)
+        for table_format in TABLE_FORMATS:
+            def render():
+                sqlitecli.formatter.format_name = table_format
+                sqlitecli.formatter.query = query
+                for title, cur, headers, _ in sqlitecli.sqlexecute.run(query):
+                    for _ in sqlitecli.format_output(title, cur, headers):
+                        pass
+            measure('render/{0}/{1}'.format(name, table_format), render,
+                    repeat, results)
+
+
+def bench_complete(paths, repeat, results):
+    completer = SQLCompleter()
+    for path in (paths['many'], paths['wide']):
+        executor = SQLExecute(path)
+        for refresher in CompletionRefresher.refreshers.values():
+            refresher(completer, executor)
+
+    for suggestion, text in COMPLETIONS:
+        document = Document(text, len(text))
+        measure('complete/{0}'.format(suggestion),
+                lambda: completer.get_completions(document, None),
+                repeat, results)
+
+    # A long buffer of many statements, completing at its end.
+    text = 'SELECT * FROM t0001;\n' * 300 + 'SELECT * FROM t0001 WHERE '
+    document = Document(text, len(text))
+    measure('complete/long_buffer',
+            lambda: completer.get_completions(document, None), repeat, results)
+
+
+def bench_startup(paths, repeat, results):
+    """Time how long the client takes to start, e.g. to run a script."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    commands = (
+        ('startup/python', ['-c', 'pass']),
+        ('startup/version', ['-m', 'sqlitecli.main', '--version']),
+        ('startup/execute', ['-m', 'sqlitecli.main', '-e', 'SELECT 1',
+                             paths['long']]),
+    )
+    with open(os.devnull, 'w') as devnull:
+        for name, args in commands:
+            command = [sys.executable] + args
+            measure(name, lambda: subprocess.check_call(
+                command, env=env, stdout=devnull), repeat, results)
+
+
+def compare(results, baseline):
+    """Print how *results* changed relative to *baseline*."""
+    before = dict((r['name'], r['min']) for r in baseline['results'])
+    for result in results:
+        if result['name'] in before and before[result['name']]:
+            print('{0:<40} {1:>7.2f}x'.format(
+                result['name'], result['min'] / before[result['name']]),
+                file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='Write the results to a file.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare the results with earlier results.')
+    parser.add_argument('--scale', type=int, default=20,
+                        help='Size of the synthetic databases.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of times each benchmark is run.')
+    parser.add_argument('-k', dest='only',
+                        help='Only run the benchmarks whose group matches.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sqlitecli-benchmark-')
+    results = []
+    try:
+        paths = create_databases(directory, args.scale)
+        groups = (('split', lambda: bench_split(args.scale, args.repeat,
+                                                results)),
+                  ('execute', lambda: bench_execute(paths, args.repeat,
+                                                    results)),
+                  ('render', lambda: bench_render(paths, args.repeat,
+                                                  results)),
+                  ('complete', lambda: bench_complete(paths, args.repeat,
+                                                      results)),
+                  ('startup', lambda: bench_startup(paths, args.repeat,
+                                                    results)))
+        for group, run in groups:
+            if not args.only or args.only in group:
+                run()
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'scale': args.scale,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output if not isinstance(output, bytes)
+                    else output.decode('utf-8'))
+    else:
+        print(output)
+
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
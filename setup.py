@@ -16,7 +16,6 @@ install_requirements = [
     'click >= 4.1',
     'Pygments >= 1.6',
     'prompt_toolkit>=1.0.10,<1.1.0',
-    'PyMySQL >= 0.6.7',
     'sqlparse>=0.2.2,<0.3.0',
     'configobj >= 5.0.5',
     'cryptography >= 1.0.0',
@@ -7,3 +7,11 @@ import sys
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 WIN = sys.platform in ('win32', 'cygwin')
+
+
+if PY2:
+    exec('def reraise(tp, value, tb=None):\n'
+         '    raise tp, value, tb\n')
+else:
+    def reraise(tp, value, tb=None):
+        raise value.with_traceback(tb)
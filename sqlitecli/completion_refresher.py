@@ -1,19 +1,38 @@
+import logging
+import sqlite3
 import threading
 from collections import OrderedDict
 
+from . import schema_cache
 from .packages.special.main import COMMANDS
 from .sqlcompleter import SQLCompleter
-from .sqlexecute import SQLExecute
+
+_logger = logging.getLogger(__name__)
 
 
 class CompletionRefresher(object):
     refreshers = OrderedDict()
 
-    def __init__(self):
+    def __init__(self, cache_dir=None):
+        """
+        cache_dir - Directory of the on-disk schema cache. Disabled if None.
+        """
         self._completer_thread = None
         self._restart_refresh = threading.Event()
+        # The (name, file) pairs of the databases attached when the last
+        # refresh was requested.
+        self._attached = []
+        # Background executors of the attached databases, keyed by file. Each
+        # one keeps the schema catalog of its file, so later refreshes only
+        # need to look at what changed. The database itself is read with the
+        # executors of the pool of its SQLExecute, which keep theirs too.
+        self._executors = {}
+        self.cache_dir = cache_dir
+        # The catalogs last written to the on-disk cache, keyed by file.
+        self._cached_catalogs = {}
 
-    def refresh(self, executor, callbacks, completer_options=None):
+    def refresh(self, executor, callbacks, completer_options=None,
+                completer=None):
         """Creates a SQLCompleter object and populates it with the relevant
         completion suggestions in a background thread.
 
@@ -23,18 +42,26 @@ class CompletionRefresher(object):
                     has completed the refresh. The newly created completion
                     object will be passed in as an argument to each callback.
         completer_options - dict of options to pass to SQLCompleter.
+        completer - The SQLCompleter currently in use. If the schema of the
+                    database has been read before, this completer is patched
+                    in place with the tables that changed instead of building
+                    a new one, and is passed to the callbacks.
 
         """
         if completer_options is None:
             completer_options = {}
 
+        # The attached databases are only known to the connection of the
+        # executor, which can't be used in the background.
+        self._attached = executor.attached_databases()
+
         if self.is_refreshing():
             self._restart_refresh.set()
             return [(None, None, None, 'Auto-completion refresh restarted.')]
         else:
             self._completer_thread = threading.Thread(
                 target=self._bg_refresh,
-                args=(executor, callbacks, completer_options),
+                args=(executor, callbacks, completer_options, completer),
                 name='completion_refresh')
             self._completer_thread.setDaemon(True)
             self._completer_thread.start()
@@ -44,17 +71,112 @@ class CompletionRefresher(object):
     def is_refreshing(self):
         return self._completer_thread and self._completer_thread.is_alive()
 
-    def _bg_refresh(self, sqlexecute, callbacks, completer_options):
-        completer = SQLCompleter(**completer_options)
+    def load_cache(self, sqlexecute, completer_options=None):
+        """Synchronously create a SQLCompleter from the on-disk schema cache.
+
+        The cached catalog is handed to a read-only executor of the pool of
+        the database, so the next refresh only has to check that it's still
+        valid. Returns None if the database has no valid cache entry.
+        """
+        if self.cache_dir is None:
+            return None
+
+        catalog = schema_cache.load(self.cache_dir, sqlexecute)
+        if catalog is None:
+            return None
+
+        completer = SQLCompleter(**(completer_options or {}))
+        with sqlexecute.pool.executor() as executor:
+            executor.catalogs['main'] = catalog
+            self._cached_catalogs[executor.filename] = catalog
+            for refresher in self.refreshers.values():
+                refresher(completer, executor)
+        return completer
+
+    def _get_executor(self, sqlexecute, filename):
+        # Reuse the executor (and with it the schema catalog) of earlier
+        # refreshes of the same attached file. Only one refresh thread runs
+        # at a time, so it's safe to share its connection between threads.
+        executor = self._executors.get(filename)
+        if executor is None:
+            executor = sqlexecute.read_only_executor(filename)
+            self._executors[filename] = executor
+        return executor
 
-        # Create a new pgexecute method to popoulate the completions.
-        e = sqlexecute
-        executor = SQLExecute(e.filename)
+    def _close_detached(self, attached, readers):
+        """Close the executors of the files that are no longer attached,
+        once *readers* are done with them."""
+        files = set(filename for _, filename in attached)
+        for reader in readers:
+            reader.join()
+        for filename in list(self._executors):
+            if filename not in files:
+                self._executors.pop(filename).conn.close()
+
+    def _save_cache(self, executor):
+        catalog = executor.catalogs.get('main')
+        if (self.cache_dir is not None and catalog is not None and
+                self._cached_catalogs.get(executor.filename) is not catalog):
+            schema_cache.save(self.cache_dir, executor, catalog)
+            self._cached_catalogs[executor.filename] = catalog
+
+    def _bg_refresh(self, sqlexecute, callbacks, completer_options,
+                    completer=None):
+        try:
+            with sqlexecute.pool.executor() as executor:
+                self._refresh(executor, sqlexecute, callbacks,
+                              completer_options, completer)
+        except sqlite3.Error as e:
+            # E.g. the schema of a shared in-memory database is locked by a
+            # transaction of the user. The completions are left as they are.
+            _logger.debug('Unable to refresh the completions: %s', e)
+
+    def _refresh(self, executor, sqlexecute, callbacks, completer_options,
+                 completer):
+        # A restart requested before anything has been read is covered by
+        # this refresh.
+        self._restart_refresh.clear()
+        readers, started = {}, []
+        while True:
+            attached = self._attached
+            # Read the schemas of the attached databases meanwhile.
+            for name, filename in attached:
+                # In-memory and temporary databases can't be opened again.
+                if (filename and filename != executor.filename and
+                        filename not in readers):
+                    readers[filename] = CatalogReader(
+                        self._get_executor(sqlexecute, filename))
+                    readers[filename].start()
+                    started.append(readers[filename])
+
+            previous = executor.catalogs.get('main')
+            if completer is not None and previous is not None:
+                update_relations(completer, previous,
+                                 executor.schema_catalog())
+            else:
+                completer = SQLCompleter(**completer_options)
+                self._run_refreshers(completer, executor)
+
+            self._save_cache(executor)
+            refresh_attached(completer, attached, readers,
+                             executor.catalogs.get('main'))
+
+            if not self._restart_refresh.is_set():
+                break
+            # Start over, only patching in what changed meanwhile.
+            self._restart_refresh.clear()
+            readers = {}
+
+        self._close_detached(attached, started)
 
         # If callbacks is a single function then push it into a list.
         if callable(callbacks):
             callbacks = [callbacks]
 
+        for callback in callbacks:
+            callback(completer)
+
+    def _run_refreshers(self, completer, executor):
         while 1:
             for refresher in self.refreshers.values():
                 refresher(completer, executor)
@@ -70,8 +192,103 @@ class CompletionRefresher(object):
             # break statement.
             continue
 
-        for callback in callbacks:
-            callback(completer)
+
+class CatalogReader(threading.Thread):
+    """Read the schema catalog of an executor in a thread of its own.
+
+    sqlite3 releases the GIL while it runs statements, so the databases of
+    several readers are introspected in parallel.
+    """
+
+    def __init__(self, executor):
+        threading.Thread.__init__(self, name='catalog_reader')
+        self.setDaemon(True)
+        self.executor = executor
+        # The catalog read before, and the one read by this thread.
+        self.previous = executor.catalogs.get('main')
+        self.catalog = None
+
+    def run(self):
+        try:
+            self.catalog = self.executor.schema_catalog()
+        except sqlite3.Error as e:
+            _logger.debug('Unable to read the schema of %r: %s',
+                          self.executor.filename, e)
+
+
+def refresh_attached(completer, attached, readers, main_catalog=None):
+    """Add the schemas of the *attached* databases to *completer*, from
+    the catalogs of their *readers*.
+
+    Schemas that are still attached to the same file only get the tables
+    that changed patched in, those that have been detached are removed.
+    *readers* are keyed by file.
+    A database attached twice shares the *main_catalog*.
+    """
+    names = [name for name, _ in attached]
+    for name in list(completer.attached):
+        if name not in names:
+            completer.drop_schema(name)
+            if name in completer.databases:
+                completer.databases.remove(name)
+
+    for name, filename in attached:
+        reader = readers.get(filename)
+        if reader is not None:
+            reader.join()
+            previous, catalog = reader.previous, reader.catalog
+        else:
+            previous = catalog = main_catalog if filename else None
+
+        if (completer.attached.get(name) == filename and
+                previous is not None and catalog is not None):
+            update_relations(completer, previous, catalog, schema=name)
+        else:
+            # The completer may be in use, so the schema is swapped in
+            # whole rather than built up in place.
+            completer.drop_schema(name)
+            for kind in ('tables', 'views'):
+                relations = sorted(catalog[kind].items()) if catalog else []
+                completer.update_relations(
+                    kind, [(rel, [column.name for column in columns])
+                           for rel, columns in relations], schema=name)
+        completer.attached[name] = filename
+
+    completer.extend_database_names(
+        name for name in names if name not in completer.databases)
+
+
+def update_relations(completer, previous, catalog, schema=None):
+    """Patch the tables and views in *completer* that differ between the
+    *previous* and the current *catalog*.
+
+    Unchanged relations share their column lists between catalogs, so this is
+    a no-op when the catalog hasn't changed at all."""
+    if catalog is previous:
+        return
+
+    for kind in ('tables', 'views'):
+        old, new = previous[kind], catalog[kind]
+        changed = [(name, [column.name for column in columns])
+                   for name, columns in sorted(new.items())
+                   if old.get(name) is not columns]
+        removed = [name for name in old if name not in new]
+        if changed or removed:
+            completer.update_relations(kind, changed, removed,
+                                       schema=schema)
+
+
+def extend_relations(completer, catalog, schema=None):
+    """Add the tables and views of *catalog* to *completer*."""
+    for kind in ('tables', 'views'):
+        relations = sorted(catalog[kind].items())
+        completer.extend_relations(((name, ) for name, _ in relations),
+                                   kind=kind, schema=schema)
+        completer.extend_columns(((name, column.name)
+                                  for name, columns in relations
+                                  for column in columns),
+                                 kind=kind, schema=schema)
+
 
 def refresher(name, refreshers=CompletionRefresher.refreshers):
     """Decorator to add the decorated function to the dictionary of
@@ -90,16 +307,15 @@ def refresh_databases(completer, executor):
 
 @refresher('schemata')
 def refresh_schemata(completer, executor):
-    # schemata - In MySQL Schema is the same as database. But for mycli
-    # schemata will be the name of the current database.
+    # The tables of the database file are in its main schema. The schemas
+    # of the attached databases are added by refresh_attached().
     completer.extend_schemata(executor.dbname)
     completer.set_dbname(executor.dbname)
 
 
 @refresher('tables')
 def refresh_tables(completer, executor):
-    completer.extend_relations(executor.tables(), kind='tables')
-    completer.extend_columns(executor.table_columns(), kind='tables')
+    extend_relations(completer, executor.schema_catalog())
 
 
 @refresher('special_commands')
@@ -8,8 +8,6 @@ import struct
 import sys
 
 from configobj import ConfigObj, ConfigObjError
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
 
 try:
     basestring
@@ -201,6 +199,11 @@ def str_to_bool(s):
 
 def _get_decryptor(key):
     """Get the AES decryptor."""
+    # Only needed for login path files, which are rare, and cryptography is
+    # slow to import.
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.backends import default_backend
+
     c = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
     return c.decryptor()
 
@@ -7,9 +7,14 @@ from sqlitecli.compat import PY2
 if PY2:
     text_type = unicode
     binary_type = str
+    integer_types = (int, long)
+    # The types sqlite3 returns BLOBs as, or accepts them as.
+    blob_types = (buffer, bytearray, binary_type)
 else:
     text_type = str
     binary_type = bytes
+    integer_types = (int, )
+    blob_types = (bytearray, memoryview, binary_type)
 
 
 def unicode2utf8(arg):
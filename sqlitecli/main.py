@@ -2,11 +2,11 @@ from __future__ import unicode_literals
 from __future__ import print_function
 
 import os
+import sqlite3
 import sys
 import traceback
 import logging
 import threading
-from time import time
 from datetime import datetime
 from random import choice
 from io import open
@@ -14,35 +14,23 @@ from io import open
 from cli_helpers.tabular_output import TabularOutputFormatter
 from cli_helpers.tabular_output import preprocessors
 import click
-import sqlparse
-from prompt_toolkit import CommandLineInterface, Application, AbortAction
-from prompt_toolkit.interface import AcceptAction
-from prompt_toolkit.enums import DEFAULT_BUFFER, EditingMode
-from prompt_toolkit.shortcuts import create_prompt_layout, create_eventloop
-from prompt_toolkit.styles.from_pygments import style_from_pygments
-from prompt_toolkit.document import Document
-from prompt_toolkit.filters import Always, HasFocus, IsDone
-from prompt_toolkit.layout.processors import (HighlightMatchingBracketProcessor,
-                                              ConditionalProcessor)
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from pygments.token import Token
 
 from .packages.special.main import NO_QUERY
 from .packages.prompt_utils import confirm, confirm_destructive_query, prompt
+from .packages.parseutils import (iter_statements, split_statements, first_word,
+                                  parse)
+from .packages.profiling import timed
 from .packages.tabular_output import sql_format
+from .packages.tabular_output.streaming import (iter_windows, format_windows,
+                                                delimited_formats)
+from .packages.tabular_output.column_types import (infer_column_types,
+                                                   affinity_type)
 import packages.special as special
-from .sqlcompleter import SQLCompleter
-from .clitoolbar import create_toolbar_tokens_func
 from .clistyle import style_factory
-from .sqlexecute import FIELD_TYPES, SQLExecute
-from .clibuffer import CLIBuffer
-from .completion_refresher import CompletionRefresher
+from .sqlexecute import SQLExecute, BufferedCursor
 from .config import (write_default_config, get_mylogin_cnf_path,
-                     open_mylogin_cnf, read_config_files, str_to_bool)
-from .key_bindings import cli_bindings
+                     open_mylogin_cnf, read_config_files, str_to_bool, log)
 from .encodingutils import utf8tounicode, text_type
-from .lexer import Lexer
 from .__init__ import __version__
 from .compat import WIN
 from .packages.filepaths import dir_path_exists
@@ -56,7 +44,6 @@ try:
     FileNotFoundError = OSError
 except ImportError:
     from urllib.parse import urlparse
-from pymysql import OperationalError
 
 from collections import namedtuple
 
@@ -65,6 +52,8 @@ Query = namedtuple('Query', ['query', 'successful', 'mutating'])
 
 PACKAGE_ROOT = os.path.abspath(os.path.dirname(__file__))
 
+_logger = logging.getLogger(__name__)
+
 
 class SQLiteCli(object):
     DEFAULT_PROMPT = 'sqlite> '
@@ -79,28 +68,37 @@ class SQLiteCli(object):
 
         self.explicit_pager = False
         self.logfile = None
+        self.output_window_size = self.config['main'].as_int(
+            'output_window_size')
+        self.row_limit = self.config['main'].as_int('row_limit')
+        special.set_timing_enabled(self.config['main'].as_bool('timing'))
+        self.timing_log = os.path.expanduser(
+            self.config['main'].get('timing_log') or '') or None
+        self.show_query_progress = self.config['main'].as_bool(
+            'show_query_progress')
+        self.progress_active = False
+        self.progress_origin = None
+        self.progress_line = ''
 
         # Init formatter
         self.formatter = TabularOutputFormatter(
             format_name=self.config['main']['table_format']
         )
         self.formatter.cli = self
-        sql_format.register_new_formatter(self.formatter)
+        sql_format.register_new_formatter(
+            self.formatter,
+            insert_rows=self.config['main'].as_int('sql_insert_rows'))
 
         # Init style
         self.syntax_style = self.config['main']['syntax_style']
         self.cli_style = self.config['colors']
         self.output_style = style_factory(self.syntax_style, self.cli_style)
 
-        # Init completer.
+        # The completer is created by init_completer(), when it's first
+        # needed.
         self.smart_completion = self.config['main'].as_bool('smart_completion')
-        self.completer = SQLCompleter(
-            self.smart_completion,
-            supported_formats=self.formatter.supported_formats,
-            keyword_casing=self.config['main'].get('keyword_casing', 'auto')
-        )
+        self.completer = None
         self._completer_lock = threading.Lock()
-        self.completion_refresher = CompletionRefresher()
 
         # Register custom special commands
         self.register_special_commands()
@@ -117,11 +115,58 @@ class SQLiteCli(object):
         ]
         return read_config_files(config_files)
 
+    def init_completer(self):
+        """Create the completer and the completion refresher.
+
+        They need prompt_toolkit, which takes longer to import than running
+        most scripts does, so they're only created for interactive use.
+        """
+        if self.completer is not None:
+            return
+        from .sqlcompleter import SQLCompleter, CancellableCompleter
+        from .completion_refresher import CompletionRefresher
+
+        self.completer = SQLCompleter(
+            self.smart_completion,
+            supported_formats=self.formatter.supported_formats,
+            keyword_casing=self.config['main'].get('keyword_casing', 'auto')
+        )
+        budget = self.config['main'].as_int('completion_budget')
+        self.cancellable_completer = CancellableCompleter(
+            self.completer, budget=budget / 1000.0 if budget else None)
+        self.completion_refresher = CompletionRefresher(
+            cache_dir=self.config['main'].get('schema_cache_dir') or None)
+
     def connect(self, filename=None):
-        self.sqlexecute = SQLExecute(filename)
+        self.sqlexecute = SQLExecute(filename, **self.connect_options())
+
+    def connect_options(self):
+        """Read the options of sqlite3.connect() from the config."""
+        c = self.config['main']
+        isolation_level = c.get('isolation_level', '').upper() or None
+        detect_types = 0
+        # configobj reads comma separated values as lists.
+        names = ' '.join(c.as_list('detect_types')).replace(',', ' ')
+        for name in names.split():
+            flag = getattr(sqlite3, 'PARSE_' + name.upper(), None)
+            if flag is None:
+                log(_logger, logging.ERROR, "Unknown detect_types value "
+                    "'{0}' in the config, expected decltypes or "
+                    "colnames.".format(name))
+                continue
+            detect_types |= flag
+        return {'cached_statements': c.as_int('cached_statements'),
+                'check_same_thread': c.as_bool('check_same_thread'),
+                'isolation_level': isolation_level,
+                'detect_types': detect_types,
+                'uri': c.as_bool('uri')}
 
     def run_cli(self):
+        from prompt_toolkit.history import FileHistory
+
         self.iterations = 0
+        self.init_completer()
+        self.load_cached_completions()
         self.refresh_completions()
 
         history_file = os.path.expanduser(
@@ -147,53 +192,91 @@ class SQLiteCli(object):
             mutating = False
 
             try:
-                special.write_tee(self.get_prompt(self.prompt) + document.text)
-                successful = False
-                start = time()
-                res = self.sqlexecute.run(document.text)
-                successful = True
-                threshold = 1000
-                result_count = 0
-
-                for title, cur, headers, status in res:
-                    if (is_select(status)
-                        and cur and cur.rowcount > threshold):
-                        self.echo(
-                            'The result set has more than {} rows.'.forma(threshold),
-                            fg='red'
+                with self.sqlexecute.cancellable(self.show_progress):
+                    special.write_tee(self.get_prompt(self.prompt) + document.text)
+                    successful = False
+                    self.progress_active = self.show_query_progress
+                    self.formatter.query = document.text
+                    profiles = None
+                    if special.is_timing_enabled() or self.timing_log:
+                        profiles = []
+                    res = self.sqlexecute.run(document.text, profiles)
+                    successful = True
+                    threshold = self.row_limit
+                    result_count = 0
+
+                    for title, cur, headers, status in res:
+                        profile = profiles[-1] if profiles else None
+                        if profile is not None:
+                            cur = profile.wrap_cursor(cur)
+                        # sqlite3 doesn't know the size of a result set before
+                        # it has been read (rowcount is always -1 for SELECT), so
+                        # read ahead just past the limit to find out.
+                        if threshold and hasattr(cur, 'fetchmany'):
+                            cur = BufferedCursor(cur, threshold + 1)
+                            self.clear_progress()
+                            if cur.buffered > threshold:
+                                self.echo(
+                                    'The result set has more than {} rows.'.format(threshold),
+                                    fg='red'
+                                )
+                                if not confirm('Do you want to continue?'):
+                                    self.echo('Aborted!', err=True, fg='red')
+                                    break
+
+                        formatted = self.format_output(
+                            title, cur, headers, special.is_expanded_output(), None
                         )
-                        if not confirm('Do you want to continue?'):
-                            self.echo('Aborted!', err=True, fg='red')
-                            break
-
-                    formatted = self.format_output(
-                        title, cur, headers, special.is_expanded_output(), None
-                    )
-
-                    t = time() - start
-                    try:
-                        if result_count > 0:
-                            self.echo('')
+                        if profile is not None:
+                            formatted = profile.wrap_output(formatted)
+
+                        self.clear_progress()
                         try:
-                            self.output(formatted, status)
+                            if result_count > 0:
+                                self.echo('')
+                            written = special.get_output_counters()
+                            try:
+                                with timed(profile, 'output'):
+                                    self.output(formatted, status)
+                            except KeyboardInterrupt:
+                                pass
+                            if profile is not None:
+                                profile.count_file_output(
+                                    written, special.get_output_counters())
+
+                            # Timing may have been turned on by this input,
+                            # after its statements started being profiled.
+                            if (special.is_timing_enabled() and
+                                    profile is not None):
+                                self.echo(profile.summary())
                         except KeyboardInterrupt:
                             pass
 
-                        if special.is_timing_enabled():
-                            self.echo('Time: %0.03fs' % t)
-                    except KeyboardInterrupt:
-                        pass
-
-                    start = time()
-                    result_count += 1
-                    mutating = mutating or is_mutating(status)
-                special.unset_once_if_written()
+                        special.flush_output()
+                        self.log_timing(profile)
+                        result_count += 1
+                        mutating = mutating or is_mutating(status)
+                        self.progress_active = self.show_query_progress
+                    special.unset_once_if_written()
+                    # Refresh the table names and column names if necessary.
+                    if need_completion_refresh(document.text):
+                        self.refresh_completions(
+                            reset=need_completion_reset(document.text))
             except EOFError as e:
                 raise e
             except KeyboardInterrupt:
                 pass
             except NotImplementedError:
                 self.echo('Not Yet Implemented.', fg="yellow")
+            except sqlite3.OperationalError as e:
+                if str(e) == 'interrupted':
+                    self.echo('Query cancelled.', err=True, fg='red')
+                else:
+                    self.echo(str(e), err=True, fg='red')
+            except sqlite3.Error as e:
+                self.echo(str(e), err=True, fg='red')
+            finally:
+                self.clear_progress()
 
             query = Query(document.text, successful, mutating)
 
@@ -205,6 +288,21 @@ class SQLiteCli(object):
             special.close_tee()
 
     def _build_cli(self, history):
+        from prompt_toolkit import CommandLineInterface, Application, AbortAction
+        from prompt_toolkit.interface import AcceptAction
+        from prompt_toolkit.enums import DEFAULT_BUFFER, EditingMode
+        from prompt_toolkit.shortcuts import create_prompt_layout, create_eventloop
+        from prompt_toolkit.styles.from_pygments import style_from_pygments
+        from prompt_toolkit.filters import Always, HasFocus, IsDone
+        from prompt_toolkit.layout.processors import (
+            HighlightMatchingBracketProcessor, ConditionalProcessor)
+        from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+        from pygments.token import Token
+        from .clibuffer import CLIBuffer
+        from .clitoolbar import create_toolbar_tokens_func
+        from .key_bindings import cli_bindings
+        from .lexer import Lexer
+
         key_binding_manager = cli_bindings()
 
         def prompt_tokens(cli):
@@ -246,11 +344,13 @@ class SQLiteCli(object):
         with self._completer_lock:
             buf = CLIBuffer(
                 always_multiline=self.multi_line,
-                completer=self.completer,
+                completer=self.cancellable_completer,
                 history=history,
                 auto_suggest=AutoSuggestFromHistory(),
                 complete_while_typing=Always(),
                 accept_action=AcceptAction.RETURN_DOCUMENT)
+            # Give up on completions for text that has changed since.
+            buf.on_text_changed += lambda _: self.cancellable_completer.cancel()
 
             if self.key_bindings == 'vi':
                 editing_mode = EditingMode.VI
@@ -290,6 +390,20 @@ class SQLiteCli(object):
         string = string.replace('\\_', ' ')
         return string
 
+    def declared_types(self, headers):
+        """Get the types of the *headers* of the last query by the declared
+        types of the columns they come from, or None."""
+        query = self.formatter.query
+        if not query or not self.sqlexecute:
+            return None
+        try:
+            declared = self.sqlexecute.declared_types(query, headers)
+        except sqlite3.Error as e:
+            self.logger.debug('Unable to read the declared types: %s', e)
+            return None
+        return declared and [affinity_type(t) if t is not None else None
+                             for t in declared]
+
     def get_reserved_space(self):
         """Get the number of lines to reserve for the completion menu."""
         reserved_space_ratio = .45
@@ -299,7 +413,25 @@ class SQLiteCli(object):
 
 
     def register_special_commands(self):
-        pass
+        special.register_special_command(
+            self.refresh_completions, 'rehash', '\\#',
+            'Refresh auto-completions.', arg_type=NO_QUERY, aliases=('\\#',))
+        special.register_special_command(
+            self.change_table_format, 'tableformat', '\\T',
+            'Change the table format used to output results.',
+            aliases=('\\T',), case_sensitive=True)
+
+    def change_table_format(self, arg, **_):
+        try:
+            self.formatter.format_name = arg
+            yield (None, None, None,
+                   'Changed table format to {}'.format(arg))
+        except ValueError:
+            msg = 'Table format {} not recognized. Allowed formats:'.format(
+                arg)
+            for table_type in self.formatter.supported_formats:
+                msg += "\n\t{}".format(table_type)
+            yield (None, None, None, msg)
 
     def handle_editor_command(self, cli, document):
         """
@@ -317,6 +449,8 @@ class SQLiteCli(object):
         # FIXME: using application.pre_run_callables like this here is not the best solution.
         # It's internal api of prompt_toolkit that may change. This was added to fix
         # https://github.com/dbcli/pgcli/issues/668. We may find a better way to do it in the future.
+        from prompt_toolkit.document import Document
+
         saved_callables = cli.application.pre_run_callables
         while special.editor_command(document.text):
             filename = special.get_filename(document.text)
@@ -338,6 +472,17 @@ class SQLiteCli(object):
         if self.logfile:
             click.echo(utf8tounicode(output), file=self.logfile)
 
+    def log_timing(self, profile):
+        """Append the timings of a statement to the timing log, if it's
+        enabled."""
+        if self.timing_log and profile is not None:
+            try:
+                with open(self.timing_log, 'a', encoding='utf-8') as f:
+                    profile.write_record(f)
+            except (IOError, OSError) as e:
+                self.echo('Unable to write the timing log: {}'.format(e),
+                          err=True, fg='red')
+
     def echo(self, s, **kwargs):
         """Print a message to stdout.
 
@@ -349,6 +494,32 @@ class SQLiteCli(object):
         self.log_output(s)
         click.secho(s, **kwargs)
 
+    def show_progress(self, steps, elapsed):
+        """Show how long the statement being run has been busy on stderr."""
+        if not self.progress_active:
+            return
+        # The counts are cumulative, make them relative to the statement.
+        if self.progress_origin is None:
+            self.progress_origin = (steps, elapsed)
+        steps -= self.progress_origin[0]
+        elapsed -= self.progress_origin[1]
+        if elapsed < 1 or not sys.stderr.isatty():
+            return
+        line = 'Running for {0:.1f}s, {1:,} steps. Press Ctrl-C to cancel.'.format(
+            elapsed, steps)
+        click.echo('\r' + line, nl=False, err=True)
+        self.progress_line = line
+
+    def clear_progress(self):
+        """Erase the progress line, and stop showing progress until the
+        next statement runs."""
+        self.progress_active = False
+        self.progress_origin = None
+        if self.progress_line:
+            click.echo('\r' + ' ' * len(self.progress_line) + '\r', nl=False,
+                       err=True)
+            self.progress_line = ''
+
     def get_output_margin(self, status=None):
         """Get the output margin (number of rows for the prompt, footer and
         timing message."""
@@ -413,15 +584,30 @@ class SQLiteCli(object):
             self.log_output(status)
             click.secho(status)
 
+    def load_cached_completions(self):
+        """Populate the completer from the on-disk schema cache, if it holds
+        a valid entry for the database."""
+        completer = self.completion_refresher.load_cache(
+            self.sqlexecute, self._completer_options())
+        if completer is not None:
+            self._on_completions_refreshed(completer)
+
+    def _completer_options(self):
+        return {'smart_completion': self.smart_completion,
+                'supported_formats': self.formatter.supported_formats,
+                'keyword_casing': self.completer.keyword_casing}
+
     def refresh_completions(self, reset=False):
+        self.init_completer()
         if reset:
             with self._completer_lock:
                 self.completer.reset_completions()
+        # Unless the completions are reset, the refresher only patches the
+        # tables that changed since the last refresh into the live completer.
         self.completion_refresher.refresh(
             self.sqlexecute, self._on_completions_refreshed,
-            {'smart_completion': self.smart_completion,
-             'supported_formats': self.formatter.supported_formats,
-             'keyword_casing': self.completer.keyword_casing})
+            self._completer_options(),
+            completer=None if reset else self.completer)
 
         return [(None, None, None,
                 'Auto-completion refresh started in the background.')]
@@ -431,11 +617,7 @@ class SQLiteCli(object):
         """
         with self._completer_lock:
             self.completer = new_completer
-            # When cli is first launched we call refresh_completions before
-            # instantiating the cli object. So it is necessary to check if cli
-            # exists before trying the replace the completer object in cli.
-            if self.cli:
-                self.cli.current_buffer.completer = new_completer
+            self.cancellable_completer.completer = new_completer
 
         if self.cli:
             # After refreshing, redraw the CLI to clear the statusbar
@@ -443,13 +625,19 @@ class SQLiteCli(object):
             self.cli.request_redraw()
 
     def get_completions(self, text, cursor_positition):
+        from prompt_toolkit.document import Document
+
+        self.init_completer()
         with self._completer_lock:
             return self.completer.get_completions(
                 Document(text=text, cursor_position=cursor_positition), None)
 
-    def run_query(self, query, new_line=True):
-        """Runs *query*."""
-        results = self.sqlexecute.run(query)
+    def run_query(self, query, new_line=True, batch=False):
+        """Runs *query*, a single statement of a script in *batch* mode."""
+        if batch:
+            results = self.sqlexecute.run_batch(query)
+        else:
+            results = self.sqlexecute.run(query)
         for result in results:
             title, cur, headers, status = result
             self.formatter.query = query
@@ -457,6 +645,16 @@ class SQLiteCli(object):
             for line in output:
                 click.echo(line, nl=new_line)
 
+    def run_script(self, lines, new_line=True):
+        """Runs the statements read from *lines* one at a time.
+
+        Each statement is executed as soon as it is complete, so the input
+        (e.g. stdin) is never read into memory as a whole.
+        """
+        with self.sqlexecute.cancellable():
+            for query in iter_statements(lines):
+                self.run_query(query, new_line=new_line, batch=True)
+
     def format_output(self, title, cur, headers, expanded=False,
                       max_width=None):
         expanded = expanded or self.formatter.format_name == 'vertical'
@@ -465,7 +663,6 @@ class SQLiteCli(object):
         output_kwargs = {
             'disable_numparse': True,
             'preserve_whitespace': True,
-            'preprocessors': (preprocessors.align_decimals, ),
             'style': self.output_style
         }
 
@@ -473,37 +670,44 @@ class SQLiteCli(object):
             output = itertools.chain(output, [title])
 
         if cur:
-            column_types = None
-            if hasattr(cur, 'description'):
-                def get_col_type(col):
-                    col_type = FIELD_TYPES.get(col[1], text_type)
-                    return col_type if type(col_type) is type else text_type
-                column_types = [get_col_type(col) for col in cur.description]
-
-            if max_width is not None:
-                cur = list(cur)
-
-            formatted = self.formatter.format_output(
-                cur, headers, format_name='vertical' if expanded else None,
-                column_types=column_types,
-                **output_kwargs)
+            windows = iter_windows(cur, self.output_window_size)
+            format_name = 'vertical' if expanded else None
 
-            if isinstance(formatted, (text_type)):
-                formatted = formatted.splitlines()
-            formatted = iter(formatted)
-
-            first_line = next(formatted)
-            formatted = itertools.chain([first_line], formatted)
-
-            if (not expanded and max_width and headers and cur and
-                    len(first_line) > max_width):
+            # Infer the types of the columns from the first window.
+            first_window = next(windows)
+            windows = itertools.chain([first_window], windows)
+            column_types = None
+            if headers:
+                column_types = infer_column_types(
+                    first_window, len(headers),
+                    lambda: self.declared_types(headers))
+
+            # Only align the decimals of float columns, and never in the
+            # delimited and sql formats, which need the numbers as they are.
+            name = format_name or self.formatter.format_name
+            if (column_types and float in column_types and
+                    name not in delimited_formats and
+                    not name.startswith('sql-')):
+                output_kwargs['preprocessors'] = (
+                    preprocessors.align_decimals, )
+
+            if not expanded and max_width and headers and first_window:
+                # Decide on the layout by looking at the first window only,
+                # so that the result doesn't have to be read in full.
                 formatted = self.formatter.format_output(
-                    cur, headers, format_name='vertical', column_types=column_types, **output_kwargs)
+                    first_window, headers, column_types=column_types,
+                    **output_kwargs)
                 if isinstance(formatted, (text_type)):
-                    formatted = iter(formatted.splitlines())
+                    formatted = formatted.splitlines()
+                first_line = next(iter(formatted), '')
+                if len(first_line) > max_width:
+                    format_name = 'vertical'
 
-            output = itertools.chain(output, formatted)
+            formatted = format_windows(
+                self.formatter, windows, headers, format_name=format_name,
+                column_types=column_types, **output_kwargs)
 
+            output = itertools.chain(output, formatted)
 
         return output
 
@@ -522,14 +726,12 @@ class SQLiteCli(object):
 def need_completion_refresh(queries):
     """Determines if the completion needs a refresh by checking if the sql
     statement is an alter, create, drop or change db."""
-    for query in sqlparse.split(queries):
-        try:
-            first_token = query.split()[0]
-            if first_token.lower() in ('alter', 'create', 'use', '\\r',
-                    '\\u', 'connect', 'drop'):
-                return True
-        except Exception:
-            return False
+    for query in split_statements(queries):
+        if first_word(query) in ('alter', 'create', 'use', '\\r', '\\u',
+                                 'connect', 'drop', '\\import', 'attach',
+                                 'detach', '\\attach', '\\detach'):
+            return True
+    return False
 
 
 def is_dropping_database(queries, dbname):
@@ -542,7 +744,10 @@ def is_dropping_database(queries, dbname):
 
     dbname = normalize_db_name(dbname)
 
-    for query in sqlparse.parse(queries):
+    for statement in split_statements(queries):
+        if first_word(statement) != 'drop':
+            continue
+        query = parse(statement)[0]
         if query.get_name() is None:
             continue
 
@@ -560,13 +765,10 @@ def need_completion_reset(queries):
     When a database is changed the existing completions must be reset before we
     start the completion refresh for the new database.
     """
-    for query in sqlparse.split(queries):
-        try:
-            first_token = query.split()[0]
-            if first_token.lower() in ('use', '\\u'):
-                return True
-        except Exception:
-            return False
+    for query in split_statements(queries):
+        if first_word(query) in ('use', '\\u'):
+            return True
+    return False
 
 
 def is_mutating(status):
@@ -604,15 +806,23 @@ def thanks_picker(files=()):
               type=click.Path(),
               default="~/.sqliteclirc",
               help='Location of sqliteclirc file.')
+@click.option('-t', '--table', is_flag=True,
+              help='Display batch output in table format.')
+@click.option('--csv', is_flag=True,
+              help='Display batch output in CSV format.')
+@click.option('-e', '--execute', type=str,
+              help='Execute command and quit.')
 @click.argument('filename',
                 required=False)
-def cli(version, prompt, sqliteclirc, filename):
+def cli(version, prompt, sqliteclirc, table, csv, execute, filename):
     '''A SQLite terminal client with auto-competion and syntax highlighting.
 
     \b
     Examples:
         - sqlitecli
         - sqlitecli filename
+        - sqlitecli filename < script.sql
+        - sqlitecli -e 'select * from t' filename
     '''
     if version:
         print('Version: ', __version__)
@@ -625,8 +835,30 @@ def cli(version, prompt, sqliteclirc, filename):
 
     sqlitecli.connect(filename)
 
-    if sys.stdin.isatty():
+    if execute:
+        lines = [execute]
+    elif sys.stdin.isatty():
         sqlitecli.run_cli()
+        sys.exit(0)
+    else:
+        # Read stdin in blocks, click's text stream reads it a line at a time
+        # on Python 2.
+        lines = open(sys.stdin.fileno(), encoding=sys.stdin.encoding or 'utf-8',
+                     errors='replace', closefd=False)
+
+    # Batch mode: statements are executed as they are read and their results
+    # are streamed to stdout.
+    try:
+        if csv:
+            sqlitecli.formatter.format_name = 'csv'
+        elif not table:
+            sqlitecli.formatter.format_name = 'tsv'
+
+        sqlitecli.run_script(lines)
+        sys.exit(0)
+    except Exception as e:
+        click.secho(str(e), err=True, fg='red')
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+from __future__ import unicode_literals
+from bisect import bisect_left
+from re import compile, escape
+
+
+def fuzzy_pattern(text):
+    """Compile the pattern used to fuzzy match *text* against a candidate.
+
+    The characters of *text* have to appear in the candidate in order, but
+    not necessarily next to each other.
+    """
+    return compile('(%s)' % '.*?'.join(map(escape, text)))
+
+
+class CandidateIndex(object):
+    """A set of completion candidates indexed for fast lookups.
+
+    The lowercase form of every candidate is computed once when it's added.
+    The lowercase forms are kept sorted, so prefix lookups are a binary
+    search, and for every character the candidates containing it are
+    tracked, so fuzzy lookups only run the pattern against candidates that
+    contain all the characters typed. The last fuzzy lookup is remembered:
+    while the user keeps typing the same word, only its matches need to be
+    searched again.
+
+    It can be used like a set of strings.
+
+    >>> index = CandidateIndex(['users', 'user_groups', 'orders'])
+    >>> [str(item) for _, _, item in sorted(index.find('us', True, False))]
+    ['user_groups', 'users']
+    >>> [str(item) for _, _, item in sorted(index.find('rs'))]
+    ['users', 'orders', 'user_groups']
+
+    """
+
+    def __init__(self, items=()):
+        self._lower = {}
+        self._chars = {}
+        self._sorted = []
+        self._dirty = False
+        self._last_fuzzy = (None, None)
+        self.update(items)
+
+    def __contains__(self, item):
+        return item in self._lower
+
+    def __iter__(self):
+        return iter(list(self._lower))
+
+    def __len__(self):
+        return len(self._lower)
+
+    def copy(self):
+        return CandidateIndex(self._lower)
+
+    def add(self, item):
+        if item in self._lower:
+            return
+        lower = item.lower()
+        self._lower[item] = lower
+        for char in set(lower):
+            self._chars.setdefault(char, set()).add(item)
+        self._dirty = True
+        self._last_fuzzy = (None, None)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def discard(self, item):
+        lower = self._lower.pop(item, None)
+        if lower is None:
+            return
+        for char in set(lower):
+            self._chars[char].discard(item)
+        self._dirty = True
+        self._last_fuzzy = (None, None)
+
+    def _sorted_lower(self):
+        if self._dirty:
+            self._sorted = sorted((lower, item)
+                                  for item, lower in self._lower.items())
+            self._dirty = False
+        return self._sorted
+
+    def find(self, text, start_only=False, fuzzy=True):
+        """Find the candidates matching the lowercase *text*.
+
+        Returns a list of (match length, match position, candidate) tuples,
+        the same keys SQLCompleter.find_matches sorts its completions by.
+        """
+        if fuzzy:
+            return self._find_fuzzy(text)
+        if start_only:
+            return self._find_prefix(text)
+        return [(len(text), lower.find(text), item)
+                for item, lower in list(self._lower.items())
+                if text in lower]
+
+    def _find_prefix(self, text):
+        entries = self._sorted_lower()
+        matches = []
+        for i in range(bisect_left(entries, (text, '')), len(entries)):
+            lower, item = entries[i]
+            if not lower.startswith(text):
+                break
+            matches.append((len(text), 0, item))
+        return matches
+
+    def _find_fuzzy(self, text):
+        last_text, last_entries = self._last_fuzzy
+        if last_text is not None and text.startswith(last_text):
+            # Every candidate matching the longer text also matched the
+            # shorter one.
+            entries = last_entries
+        elif text:
+            sets = sorted((self._chars.get(char, set()) for char in set(text)),
+                          key=len)
+            candidates = sets[0].intersection(*sets[1:])
+            # Keep the candidates in order, the matches are cheaper to sort.
+            if len(candidates) > 100:
+                entries = [entry for entry in self._sorted_lower()
+                           if entry[1] in candidates]
+            else:
+                entries = [(self._lower[item], item) for item in candidates]
+        else:
+            entries = self._sorted_lower()
+
+        search = fuzzy_pattern(text).search
+        matches = []
+        matched = []
+        for entry in entries:
+            r = search(entry[0])
+            if r:
+                matches.append((len(r.group()), r.start(), entry[1]))
+                matched.append(entry)
+
+        self._last_fuzzy = (text, matched)
+        return matches
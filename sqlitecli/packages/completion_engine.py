@@ -1,10 +1,10 @@
 from __future__ import print_function
 import os
 import sys
-import sqlparse
 from sqlparse.sql import Comparison, Identifier, Where
 from sqlparse.compat import text_type
-from .parseutils import last_word, extract_tables, find_prev_keyword
+from .parseutils import (last_word, extract_tables, find_prev_keyword,
+                         isolate_statement, parse)
 from .special import parse_special_command
 
 PY2 = sys.version_info[0] == 2
@@ -24,6 +24,8 @@ def suggest_type(full_text, text_before_cursor):
     A scope for a column category will be a list of tables.
     """
 
+    full_text, text_before_cursor = isolate_statement(full_text,
+                                                     text_before_cursor)
     word_before_cursor = last_word(text_before_cursor,
             include='many_punctuations')
 
@@ -39,20 +41,20 @@ def suggest_type(full_text, text_before_cursor):
         if word_before_cursor:
             if word_before_cursor.endswith(
                     '(') or word_before_cursor.startswith('\\'):
-                parsed = sqlparse.parse(text_before_cursor)
+                parsed = parse(text_before_cursor)
             else:
-                parsed = sqlparse.parse(
+                parsed = parse(
                     text_before_cursor[:-len(word_before_cursor)])
 
                 # word_before_cursor may include a schema qualification, like
                 # "schema_name.partial_name" or "schema_name.", so parse it
                 # separately
-                p = sqlparse.parse(word_before_cursor)[0]
+                p = parse(word_before_cursor)[0]
 
                 if p.tokens and isinstance(p.tokens[0], Identifier):
                     identifier = p.tokens[0]
         else:
-            parsed = sqlparse.parse(text_before_cursor)
+            parsed = parse(text_before_cursor)
     except (TypeError, AttributeError):
         return [{'type': 'keyword'}]
 
@@ -101,7 +103,7 @@ def suggest_special(text):
         # Trying to complete the special command itself
         return [{'type': 'special'}]
 
-    if cmd in ('\\u', '\\r'):
+    if cmd in ('\\u', '\\r', '\\detach'):
         return [{'type': 'database'}]
 
     if cmd in ('\\T'):
@@ -116,8 +118,13 @@ def suggest_special(text):
             {'type': 'view', 'schema': []},
             {'type': 'schema'},
         ]
-    elif cmd in ['\\.', 'source']:
+    elif cmd in ['\\.', 'source', '\\import', '\\export', '\\attach',
+                 '\\fanout']:
         return[{'type': 'file_name'}]
+    elif cmd == '\\explain':
+        # Complete the statement being explained.
+        statement = text.partition(' ')[2].lstrip()
+        return suggest_type(statement, statement)
 
     return [{'type': 'keyword'}, {'type': 'special'}]
 
@@ -149,7 +156,7 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
     if not token:
         return [{'type': 'keyword'}, {'type': 'special'}]
     elif token_v.endswith('('):
-        p = sqlparse.parse(text_before_cursor)[0]
+        p = parse(text_before_cursor)[0]
 
         if p.tokens and isinstance(p.tokens[-1], Where):
             # Four possibilities:
@@ -207,7 +214,7 @@ def suggest_based_on_last_token(token, text_before_cursor, full_text, identifier
     elif token_v in ('show'):
         return [{'type': 'show'}]
     elif token_v in ('to',):
-        p = sqlparse.parse(text_before_cursor)[0]
+        p = parse(text_before_cursor)[0]
         if p.token_first().value.lower() == 'change':
             return [{'type': 'change'}]
         else:
@@ -1,8 +1,10 @@
 from __future__ import print_function
 import re
-import sqlparse
-from sqlparse.sql import IdentifierList, Identifier, Function
-from sqlparse.tokens import Keyword, DML, Punctuation
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from sqlitecli.encodingutils import unicode2utf8
 
 cleanup_regex = {
         # This matches only alphanumerics and underscores.
@@ -15,6 +17,175 @@ cleanup_regex = {
         'all_punctuations': re.compile('([^\s]+)$'),
         }
 
+# The number of parsed statements kept by parse().
+PARSE_CACHE_SIZE = 16
+
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+# The last text split by split_statements(), and its statements.
+_last_split = (None, ())
+
+# Matches the whitespace and comments at the start of a statement.
+leading_comments_regex = re.compile(r'(?:\s+|--[^\n]*(?:\n|$)|/\*.*?(?:\*/|$))*',
+                                    re.DOTALL)
+
+
+def parse(sql):
+    """Parse *sql* with sqlparse, reusing recent results.
+
+    Completing a single keystroke parses the same text several times, and
+    the text before the word being typed doesn't change while typing it, so
+    the last few parses are kept in an LRU cache. The parsed statements are
+    shared, callers must not modify them.
+
+    Returns a tuple of sqlparse statements.
+    """
+    # sqlparse is imported on first use, most scripts never need to parse.
+    import sqlparse
+
+    with _parse_cache_lock:
+        parsed = _parse_cache.pop(sql, None)
+        if parsed is not None:
+            _parse_cache[sql] = parsed
+            return parsed
+
+    parsed = tuple(sqlparse.parse(sql))
+
+    with _parse_cache_lock:
+        _parse_cache[sql] = parsed
+        while len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return parsed
+
+
+def complete_statement(sql):
+    """Like sqlite3.complete_statement(), which only accepts bytes on
+    Python 2 when *sql* isn't ASCII."""
+    return sqlite3.complete_statement(unicode2utf8(sql))
+
+
+# Matches the text up to the next semi-colon that isn't in a string, a
+# quoted identifier or a comment. It stops short of a string or comment that
+# isn't closed yet.
+_unquoted_regex = re.compile(r"""(?:[^;'"`\[/-]+|'[^']*'|"[^"]*"|`[^`]*`|"""
+                             r"""\[[^\]]*\]|--[^\n]*\n|/\*.*?\*/|-(?!-)|"""
+                             r"""/(?!\*))*""", re.DOTALL)
+
+
+def _statement_end(text, start, pos):
+    """Find the end of the statement starting at *start* of *text*.
+
+    The text before *pos* is known not to end the statement. Only the
+    semi-colons outside of strings and comments are checked with
+    complete_statement(), which tells whether they're in a trigger body,
+    so the text is scanned once however many semi-colons its strings hold.
+
+    Returns the offset after the semi-colon ending the statement, or None
+    if it's incomplete, and the offset to resume the scan at once more text
+    has been added.
+    """
+    while True:
+        pos = _unquoted_regex.match(text, pos).end()
+        if pos == len(text):
+            # A trailing - or / may start a comment.
+            if text[pos - 1:pos] in ('-', '/'):
+                pos -= 1
+            return None, pos
+        if text[pos] != ';':
+            # An unclosed string or comment.
+            return None, pos
+        pos += 1
+        if complete_statement(text[start:pos]):
+            return pos, pos
+
+
+def _complete_statements(text):
+    """Split the complete statements off the start of *text*.
+
+    Returns the complete statements, each with its semi-colon, and the rest
+    of the text.
+    """
+    statements = []
+    start = pos = 0
+    while True:
+        end, pos = _statement_end(text, start, pos)
+        if end is None:
+            return statements, text[start:]
+        statements.append(text[start:end])
+        start = end
+
+
+def split_statements(text):
+    """Split *text* into SQL statements, like sqlparse.split() but without
+    parsing it.
+
+    The statements are stripped, and keep their semi-colon. Whatever follows
+    the last complete statement is returned as a statement of its own. The
+    input is typically split by several callers in a row (to execute it, to
+    decide whether to refresh the completions, ...), so the last result is
+    reused.
+
+    >>> [str(s) for s in split_statements("select 1; select ';'; select")]
+    ['select 1;', "select ';';", 'select']
+    >>> [str(s) for s in split_statements("create trigger t after insert on "
+    ...                                   "x begin select 1; end; select 2")]
+    ['create trigger t after insert on x begin select 1; end;', 'select 2']
+
+    """
+    global _last_split
+    last_text, statements = _last_split
+    if text == last_text:
+        return statements
+
+    statements, rest = _complete_statements(text)
+    statements = tuple(s.strip() for s in statements + [rest]
+                       if s.strip() not in ('', ';'))
+    _last_split = (text, statements)
+    return statements
+
+
+def first_word(statement):
+    """Return the lowercase first word of *statement*, after any comments.
+
+    >>> str(first_word('-- comment\\n /* more */ DROP TABLE x'))
+    'drop'
+
+    """
+    start = leading_comments_regex.match(statement).end()
+    words = statement[start:start + 64].split(None, 1)
+    return words[0].lower() if words else ''
+
+
+def isolate_statement(full_text, text_before_cursor):
+    """Narrow *full_text* and *text_before_cursor* down to the statement
+    the cursor is in.
+
+    Statements are delimited with sqlite3.complete_statement(), which is
+    much cheaper than parsing the whole buffer. A cursor right after a
+    semi-colon is still in the statement the semi-colon ends.
+
+    >>> isolate_statement('select 1; select 2; select 3', 'select 1; sel')
+    (' select 2;', ' sel')
+    >>> isolate_statement('select 1; select 2', 'select 1;')
+    ('select 1;', 'select 1;')
+
+    """
+    cursor = len(text_before_cursor)
+    start = pos = 0
+    while True:
+        end, pos = _statement_end(text_before_cursor, start, pos)
+        if end is None or end >= cursor:
+            break
+        start = end
+
+    end, _ = _statement_end(full_text, start, start)
+    if end is None:
+        end = len(full_text)
+
+    return full_text[start:end], text_before_cursor[start:]
+
+
 def last_word(text, include='alphanum_underscore'):
     """
     Find the last word in a sentence.
@@ -64,6 +235,8 @@ def last_word(text, include='alphanum_underscore'):
 # This code is borrowed from sqlparse example script.
 # <url>
 def is_subselect(parsed):
+    from sqlparse.tokens import DML
+
     if not parsed.is_group:
         return False
     for item in parsed.tokens:
@@ -73,6 +246,9 @@ def is_subselect(parsed):
     return False
 
 def extract_from_part(parsed, stop_at_punctuation=True):
+    from sqlparse.sql import IdentifierList
+    from sqlparse.tokens import Keyword, Punctuation
+
     tbl_prefix_seen = False
     for item in parsed.tokens:
         if tbl_prefix_seen:
@@ -109,6 +285,7 @@ def extract_from_part(parsed, stop_at_punctuation=True):
 
 def extract_table_identifiers(token_stream):
     """yields tuples of (schema_name, table_name, table_alias)"""
+    from sqlparse.sql import IdentifierList, Identifier, Function
 
     for item in token_stream:
         if isinstance(item, IdentifierList):
@@ -141,7 +318,7 @@ def extract_tables(sql):
     Returns a list of (schema, table, alias) tuples
 
     """
-    parsed = sqlparse.parse(sql)
+    parsed = parse(sql)
     if not parsed:
         return []
 
@@ -162,7 +339,7 @@ def find_prev_keyword(sql):
     if not sql.strip():
         return None, ''
 
-    parsed = sqlparse.parse(sql)[0]
+    parsed = parse(sql)[0]
     flattened = list(parsed.flatten())
 
     logical_operators = ('AND', 'OR', 'NOT', 'BETWEEN')
@@ -188,17 +365,71 @@ def find_prev_keyword(sql):
     return None, ''
 
 
+def quote_identifier(name):
+    """Quote *name* for use as an SQL identifier.
+
+    >>> print(quote_identifier('my"table'))
+    "my""table"
+    """
+    return '"{0}"'.format(name.replace('"', '""'))
+
+
+def iter_statements(lines):
+    """Yield complete SQL statements from an iterable of lines.
+
+    Lines are accumulated only until they form a complete statement (as
+    decided by :func:`sqlite3.complete_statement`), so arbitrarily large
+    scripts can be executed without reading them into memory first. Several
+    statements on one line are yielded one by one. Special commands (lines
+    starting with a backslash) are yielded on their own. Whatever is left at
+    the end of the input is yielded as is.
+    """
+    # The statement being read, and where its scan resumes.
+    text = ''
+    pos = 0
+    for line in lines:
+        if not text:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('\\'):
+                yield stripped
+                continue
+            # Most lines of a script (e.g. a dump) are a statement each.
+            if (stripped.endswith(';') and line.count(';') == 1 and
+                    complete_statement(line)):
+                yield line
+                continue
+        text += line
+        # A statement can only be complete once a semi-colon shows up.
+        if ';' not in line:
+            continue
+        start = 0
+        while True:
+            end, pos = _statement_end(text, start, pos)
+            if end is None:
+                break
+            yield text[start:end]
+            start = end
+        if not text[start:].strip():
+            text, pos = '', 0
+        elif start:
+            text, pos = text[start:], pos - start
+
+    if text.strip():
+        yield text
+
+
 def query_starts_with(query, prefixes):
     """Check if the query starts with any item from *prefixes*."""
     prefixes = [prefix.lower() for prefix in prefixes]
-    formatted_sql = sqlparse.format(query.lower(), strip_comments=True)
-    return bool(formatted_sql) and formatted_sql.split()[0] in prefixes
+    return first_word(query) in prefixes
 
 
 def queries_start_with(queries, prefixes):
     """Check if any queries start with any item from *prefixes*."""
-    for query in sqlparse.split(queries):
-        if query and query_starts_with(query, prefixes) is True:
+    for query in split_statements(queries):
+        if query_starts_with(query, prefixes):
             return True
     return False
 
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Time the phases of running a statement."""
+
+from __future__ import unicode_literals
+
+import json
+from contextlib import contextmanager
+from time import time
+
+from sqlitecli.encodingutils import text_type
+
+
+@contextmanager
+def timed(profile, phase):
+    """Add the time spent in the context to *phase* of *profile*, unless
+    *profile* is None."""
+    if profile is None:
+        yield
+        return
+    with profile.timed(phase):
+        yield
+
+
+class StatementProfile(object):
+    """The time spent in each phase of running one statement.
+
+    * split: splitting the input into statements (counted once per input)
+    * execute: preparing and executing the statement
+    * first row: fetching the first rows of the result
+    * all rows: fetching all the rows of the result (includes first row)
+    * format: formatting the rows into lines
+    * output: writing the lines to the terminal, pager or files
+
+    Rows are fetched while the result is being formatted, and formatted
+    while the lines are being written, so the time of each phase excludes
+    the time spent in the others meanwhile. The lines and bytes written to
+    the tee and once files are counted too.
+
+    >>> profile = StatementProfile('SELECT 1')
+    >>> profile.times['execute'] = 0.25
+    >>> profile.rows = 1
+    >>> print(profile.summary())
+    Time: 0.250s (execute 0.250s), 1 row, 0 bytes
+    >>> profile.count_file_output((10, 200), (12, 230))
+    >>> print(profile.summary())
+    Time: 0.250s (execute 0.250s), 1 row, 0 bytes, 2 lines (30 bytes) to files
+    >>> record = profile.as_dict()
+    >>> record['file_lines'], record['file_bytes']
+    (2, 30)
+
+    """
+
+    phases = ('split', 'execute', 'first row', 'all rows', 'format', 'output')
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.times = dict.fromkeys(self.phases, 0.0)
+        self.rows = 0
+        self.bytes = 0
+        self.file_lines = 0
+        self.file_bytes = 0
+        self._fetched = False
+
+    @contextmanager
+    def timed(self, phase):
+        """Add the time spent in the context to *phase*, except for the time
+        added to the other phases meanwhile."""
+        start = time()
+        before = self.total - self.times[phase]
+        try:
+            yield
+        finally:
+            during = self.total - self.times[phase] - before
+            self.times[phase] += time() - start - during
+
+    @property
+    def total(self):
+        return sum(elapsed for phase, elapsed in self.times.items()
+                   if phase != 'first row')
+
+    def wrap_cursor(self, cursor):
+        """Return *cursor*, timing how long its rows take to fetch.
+
+        Results that aren't cursors (e.g. the rows of special commands) are
+        returned as is.
+        """
+        if hasattr(cursor, 'fetchmany'):
+            return ProfiledCursor(cursor, self)
+        if isinstance(cursor, (list, tuple)):
+            self.rows = len(cursor)
+        return cursor
+
+    def wrap_output(self, lines):
+        """Yield the formatted *lines*, timing how long they take to format
+        and counting the bytes."""
+        lines = iter(lines)
+        while True:
+            start = time()
+            fetched = self.times['all rows']
+            line = next(lines, None)
+            self.times['format'] += (time() - start -
+                                     (self.times['all rows'] - fetched))
+            if line is None:
+                return
+            self.bytes += len(line.encode('utf-8')) + 1
+            yield line
+
+    def count_file_output(self, before, after):
+        """Add the lines and bytes written to files between the (lines,
+        bytes) output counters *before* and *after*."""
+        self.file_lines += after[0] - before[0]
+        self.file_bytes += after[1] - before[1]
+
+    def _add_fetch(self, elapsed, rows):
+        if not self._fetched:
+            self.times['first row'] = elapsed
+            self._fetched = True
+        self.times['all rows'] += elapsed
+        self.rows += rows
+
+    def as_dict(self):
+        """Return the profile as a dict, e.g. to log it."""
+        record = dict((phase.replace(' ', '_'), round(elapsed, 6))
+                      for phase, elapsed in self.times.items())
+        record.update(statement=self.statement, total=round(self.total, 6),
+                      rows=self.rows, bytes=self.bytes,
+                      file_lines=self.file_lines, file_bytes=self.file_bytes)
+        return record
+
+    def summary(self):
+        """Return a one-line report of the timings."""
+        phases = ', '.join('{0} {1:.3f}s'.format(phase, self.times[phase])
+                           for phase in self.phases if self.times[phase])
+        summary = 'Time: {0:.3f}s{1}, {2} row{3}, {4:,} bytes'.format(
+            self.total, ' ({0})'.format(phases) if phases else '',
+            self.rows, '' if self.rows == 1 else 's', self.bytes)
+        if self.file_lines:
+            summary += ', {0} line{1} ({2:,} bytes) to files'.format(
+                self.file_lines, '' if self.file_lines == 1 else 's',
+                self.file_bytes)
+        return summary
+
+    def write_record(self, file):
+        """Write the profile to *file* as a line of JSON."""
+        record = json.dumps(self.as_dict(), sort_keys=True)
+        if not isinstance(record, text_type):
+            record = record.decode('utf-8')
+        file.write(record + '\n')
+
+
+class ProfiledCursor(object):
+    """Wrap a cursor and add the time its rows take to fetch to a
+    StatementProfile.
+
+    Everything else is delegated to the wrapped cursor.
+    """
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        # Iterating is only used to read the whole result, fetchmany() is
+        # used to read it in windows.
+        return iter(self.fetchall())
+
+    def fetchmany(self, size):
+        start = time()
+        rows = self._cursor.fetchmany(size)
+        self._profile._add_fetch(time() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time()
+        rows = self._cursor.fetchall()
+        self._profile._add_fetch(time() - start, len(rows))
+        return rows
@@ -8,3 +8,4 @@ def export(defn):
 
 from . import dbcommands
 from . import iocommands
+from . import fanout
@@ -1,15 +1,24 @@
 import logging
 import os
-import platform
-from pymysql import ProgrammingError
+import re
+import shlex
+import sqlite3
+from time import time
+
+import click
 
 from sqlitecli import __version__
 from sqlitecli.packages.special import iocommands
-from sqlitecli.packages.special.utils import format_uptime
+from sqlitecli.packages.parseutils import (extract_tables, parse,
+                                           quote_identifier)
+from sqlitecli.packages.special.utils import format_size, format_uptime
 from .main import special_command, RAW_QUERY, PARSED_QUERY
 
 log = logging.getLogger(__name__)
 
+# The values of PRAGMA synchronous.
+SYNCHRONOUS_MODES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+
 
 @special_command('\\dt', '\\dt[+] [table]', 'List or describe tables.',
                  arg_type=PARSED_QUERY, case_sensitive=True)
@@ -37,41 +46,61 @@ def list_tables(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
 
 @special_command('\\l', '\\l', 'List databases.', arg_type=RAW_QUERY, case_sensitive=True)
 def list_databases(cur, **_):
-    query = 'SHOW DATABASES'
+    query = 'PRAGMA database_list'
     log.debug(query)
     cur.execute(query)
-    if cur.description:
-        headers = [x[0] for x in cur.description]
-        return [(None, cur, headers, '')]
-    else:
-        return [(None, None, None, '')]
+    headers = ['Name', 'File']
+    rows = [(row[1], row[2]) for row in cur.fetchall()]
+    return [(None, rows, headers, '')]
 
-@special_command('status', '\\s', 'Get status information from the server.',
-                 arg_type=RAW_QUERY, aliases=('\\s', ), case_sensitive=True)
-def status(cur, **_):
-    query = 'SHOW GLOBAL STATUS;'
-    log.debug(query)
+
+@special_command('\\attach', '\\attach file [name]',
+                 'Attach a database file as schema name.',
+                 arg_type=PARSED_QUERY, case_sensitive=True)
+def attach_database(cur, arg=None, **_):
+    """Attach a database file, by default as the name of the file without
+    its extension."""
+    usage = 'Syntax: \\attach file [name].'
     try:
-        cur.execute(query)
-    except ProgrammingError:
-        # Fallback in case query fail, as it does with Mysql 4
-        query = 'SHOW STATUS;'
-        log.debug(query)
-        cur.execute(query)
-    status = dict(cur.fetchall())
+        args = shlex.split(arg or '')
+    except ValueError:
+        return [(None, None, None, usage)]
+    if len(args) not in (1, 2):
+        return [(None, None, None, usage)]
 
-    query = 'SHOW GLOBAL VARIABLES;'
+    filename = os.path.expanduser(args[0])
+    if len(args) == 2:
+        name = args[1]
+    else:
+        name = os.path.splitext(os.path.basename(filename))[0]
+    query = 'ATTACH DATABASE ? AS {0}'.format(quote_identifier(name))
+    log.debug(query)
+    cur.execute(query, (filename, ))
+    return [(None, None, None, 'Attached {0} as {1}.'.format(filename, name))]
+
+
+@special_command('\\detach', '\\detach name', 'Detach a database.',
+                 arg_type=PARSED_QUERY, case_sensitive=True)
+def detach_database(cur, arg=None, **_):
+    if not arg:
+        return [(None, None, None, 'Syntax: \\detach name.')]
+    query = 'DETACH DATABASE {0}'.format(quote_identifier(arg))
     log.debug(query)
     cur.execute(query)
-    variables = dict(cur.fetchall())
+    return [(None, None, None, 'Detached {0}.'.format(arg))]
+
+
+@special_command('status', '\\s', 'Get status information from the database.',
+                 arg_type=RAW_QUERY, aliases=('\\s', ), case_sensitive=True)
+def status(cur, **_):
+    import platform
+
+    conn = cur.connection
 
-    # prepare in case keys are bytes, as with Python 3 and Mysql 4
-    if (isinstance(list(variables)[0], bytes) and
-            isinstance(list(status)[0], bytes)):
-        variables = {k.decode('utf-8'): v.decode('utf-8') for k, v
-                     in variables.items()}
-        status = {k.decode('utf-8'): v.decode('utf-8') for k, v
-                  in status.items()}
+    def pragma(name):
+        # Some pragmas return no row, e.g. mmap_size of in-memory databases.
+        row = conn.execute('PRAGMA {0}'.format(name)).fetchone()
+        return row[0] if row else None
 
     # Create output buffers.
     title = []
@@ -80,26 +109,21 @@ def status(cur, **_):
 
     title.append('--------------')
 
-    # Output the mycli client information.
+    # Output the sqlitecli client information.
     implementation = platform.python_implementation()
     version = platform.python_version()
     client_info = []
-    client_info.append('mycli {0},'.format(__version__))
+    client_info.append('sqlitecli {0},'.format(__version__))
     client_info.append('running on {0} {1}'.format(implementation, version))
     title.append(' '.join(client_info) + '\n')
 
     # Build the output that will be displayed as a table.
-    output.append(('Connection id:', cur.connection.thread_id()))
-
-    query = 'SELECT DATABASE(), USER();'
-    log.debug(query)
-    cur.execute(query)
-    db, user = cur.fetchone()
-    if db is None:
-        db = ''
-
-    output.append(('Current database:', db))
-    output.append(('Current user:', user))
+    filename = ''
+    for _, name, path in conn.execute('PRAGMA database_list'):
+        if name == 'main':
+            filename = path
+    output.append(('Database:', filename or ':memory:'))
+    output.append(('SQLite version:', sqlite3.sqlite_version))
 
     if iocommands.is_pager_enabled():
         if 'PAGER' in os.environ:
@@ -110,49 +134,270 @@ def status(cur, **_):
         pager = 'stdout'
     output.append(('Current pager:', pager))
 
-    output.append(('Server version:', '{0} {1}'.format(
-        variables['version'], variables['version_comment'])))
-    output.append(('Protocol version:', variables['protocol_version']))
+    journal_mode = pragma('journal_mode')
+    output.append(('Journal mode:', journal_mode))
+    output.append(('Synchronous:', SYNCHRONOUS_MODES.get(
+        pragma('synchronous'), '?')))
+    if journal_mode == 'wal':
+        wal = filename + '-wal'
+        wal_size = os.path.getsize(wal) if os.path.exists(wal) else 0
+        output.append(('WAL size:', format_size(wal_size)))
+        output.append(('WAL autocheckpoint:', '{0} pages'.format(
+            pragma('wal_autocheckpoint'))))
 
-    if 'unix' in cur.connection.host_info.lower():
-        host_info = cur.connection.host_info
+    page_size = pragma('page_size')
+    page_count = pragma('page_count')
+    freelist_count = pragma('freelist_count')
+    output.append(('Page size:', format_size(page_size)))
+    output.append(('Page count:', page_count))
+    output.append(('Database size:', format_size(page_size * page_count)))
+    output.append(('Free pages:', '{0} ({1:.1%})'.format(
+        freelist_count,
+        float(freelist_count) / page_count if page_count else 0)))
+
+    # A negative cache size is in KiB, a positive one in pages.
+    cache_size = pragma('cache_size')
+    if cache_size < 0:
+        cache_size = -cache_size * 1024
     else:
-        host_info = '{0} via TCP/IP'.format(cur.connection.host)
+        cache_size *= page_size
+    output.append(('Page cache size:', format_size(cache_size)))
+    cache_spill = pragma('cache_spill')
+    output.append(('Cache spill:', '{0} pages'.format(cache_spill)
+                   if cache_spill else 'off'))
+    mmap_size = pragma('mmap_size')
+    output.append(('Memory map size:', format_size(mmap_size)
+                   if mmap_size is not None else 'n/a'))
 
-    output.append(('Connection:', host_info))
+    cache = getattr(conn, 'statement_cache', None)
+    if cache is not None:
+        output.append(('Statement cache:', '{0} hits, {1} misses'.format(
+            cache.hits, cache.misses)))
 
-    query = ('SELECT @@character_set_server, @@character_set_database, '
-             '@@character_set_client, @@character_set_connection LIMIT 1;')
-    log.debug(query)
-    cur.execute(query)
-    charset = cur.fetchone()
-    output.append(('Server characterset:', charset[0]))
-    output.append(('Db characterset:', charset[1]))
-    output.append(('Client characterset:', charset[2]))
-    output.append(('Conn. characterset:', charset[3]))
-
-    if 'TCP/IP' in host_info:
-        output.append(('TCP port:', cur.connection.port))
-    else:
-        output.append(('UNIX socket:', variables['socket']))
-
-    output.append(('Uptime:', format_uptime(status['Uptime'])))
-
-    # Print the current server statistics.
-    stats = []
-    stats.append('Connections: {0}'.format(status['Threads_connected']))
-    if 'Queries' in status:
-        stats.append('Queries: {0}'.format(status['Queries']))
-    stats.append('Slow queries: {0}'.format(status['Slow_queries']))
-    stats.append('Opens: {0}'.format(status['Opened_tables']))
-    stats.append('Flush tables: {0}'.format(status['Flush_commands']))
-    stats.append('Open tables: {0}'.format(status['Open_tables']))
-    if 'Queries' in status:
-        queries_per_second = int(status['Queries']) / int(status['Uptime'])
-        stats.append('Queries per second avg: {:.3f}'.format(
-            queries_per_second))
-    stats = '  '.join(stats)
-    footer.append('\n' + stats)
+    if hasattr(conn, 'opened'):
+        uptime = time() - conn.opened
+        output.append(('Connected for:', format_uptime(uptime) or '0 sec'))
+
+        # Print the client statistics.
+        stats = []
+        stats.append('Queries: {0}'.format(conn.queries))
+        stats.append('Execute time: {0:.3f}s'.format(conn.execute_time))
+        if conn.queries:
+            stats.append('Avg execute time: {0:.3f}s'.format(
+                conn.execute_time / conn.queries))
+        stats.append('Queries per second avg: {0:.3f}'.format(
+            conn.queries / uptime if uptime else 0))
+        footer.append('\n' + '  '.join(stats))
 
     footer.append('--------------')
     return [('\n'.join(title), output, '', '\n'.join(footer))]
+
+
+@special_command('\\cache', '\\cache', 'Show the statement cache statistics.',
+                 arg_type=RAW_QUERY, case_sensitive=True)
+def statement_cache(cur, **_):
+    cache = getattr(cur.connection, 'statement_cache', None)
+    if cache is None:
+        return [(None, None, None, 'The statement cache is not tracked.')]
+    lookups = cache.hits + cache.misses
+    rows = [('Size', cache.size),
+            ('Statements', len(cache)),
+            ('Hits', cache.hits),
+            ('Misses', cache.misses),
+            ('Hit rate', '{0:.1%}'.format(
+                float(cache.hits) / lookups if lookups else 0))]
+    return [(None, rows, ['Statement cache', 'Value'], '')]
+
+# Matches the plan steps that read a table, e.g. "SCAN TABLE t AS a" (before
+# SQLite 3.36) or "SEARCH t USING INDEX i (x=?)".
+PLAN_STEP_REGEX = re.compile(
+    r'^(SCAN|SEARCH)(?: TABLE)? ("[^"]+"|\S+)(?: AS (\S+))?(.*)$')
+
+# Keywords that start the clauses whose columns may benefit from an index.
+FILTER_CLAUSES = ('WHERE', 'ON', 'USING', 'HAVING')
+ORDER_CLAUSES = ('ORDER BY', 'GROUP BY')
+OTHER_CLAUSES = ('SELECT', 'FROM', 'JOIN', 'LIMIT', 'UNION', 'SET', 'VALUES',
+                 'INSERT', 'UPDATE', 'DELETE')
+
+
+def _clause_columns(statement):
+    """Return {clause: [(qualifier, name), ...]} for the names used in the
+    filter and ordering clauses of *statement*.
+
+    Names aren't resolved here, a name may as well be a function or alias.
+    """
+    from sqlparse.tokens import Comment, Keyword, Name, Punctuation, String
+
+    tokens = [token for token in parse(statement)[0].flatten()
+              if not token.is_whitespace and token.ttype not in Comment]
+    clauses = {}
+    clause = None
+    for i, token in enumerate(tokens):
+        value = token.normalized
+        if token.ttype in Keyword:
+            if value == 'BY' and clause in ('ORDER', 'GROUP'):
+                clause += ' BY'
+                continue
+            if (value in FILTER_CLAUSES + ORDER_CLAUSES + OTHER_CLAUSES or
+                    value in ('ORDER', 'GROUP') or value.endswith('JOIN')):
+                clause = value
+                continue
+        if (clause not in FILTER_CLAUSES + ORDER_CLAUSES or
+                token.ttype not in Name and token.ttype not in Keyword and
+                token.ttype not in String.Symbol):
+            continue
+        following = tokens[i + 1].value if i + 1 < len(tokens) else None
+        if following in ('.', '('):
+            # A qualifier or a function.
+            continue
+        qualifier = None
+        if i > 1 and tokens[i - 1].match(Punctuation, '.'):
+            qualifier = tokens[i - 2].value.strip('"`[]').lower()
+        name = token.value.strip('"`[]').lower()
+        clauses.setdefault(clause, []).append((qualifier, name))
+    return clauses
+
+
+def _schema_catalogs(cur):
+    """Return the schema catalogs of the databases of the connection of
+    *cur*, in the order SQLite looks up table names in them.
+
+    They are read through the SQLExecute the connection belongs to, which
+    caches them until the schemas change.
+    """
+    executor = cur.connection.executor()
+    if executor is None:
+        return []
+    names = [row[1] for row in cur.execute('PRAGMA database_list')]
+    # Temporary tables hide the tables of the same name.
+    names.sort(key=lambda name: name != 'temp')
+    return [executor.schema_catalog(name) for name in names]
+
+
+def _table_info(catalogs, table):
+    """Return the column names and the indexes (as lists of column names)
+    of *table*, or None if it's not a table."""
+    for catalog in catalogs:
+        for name, columns in catalog['tables'].items():
+            if name.lower() == table.lower():
+                indexes = dict((index.name, index.columns)
+                               for index in catalog['indexes'].values()
+                               if index.table == name)
+                return [column.name for column in columns], indexes
+    return None
+
+
+def _index_hint(table, info, references, reason):
+    """Suggest an index on the columns of *table* among *references*."""
+    columns, indexes = info
+    known = dict((c.lower(), c) for c in columns)
+    wanted = []
+    for qualifier, name in references:
+        if name in known and known[name] not in wanted:
+            wanted.append(known[name])
+    if not wanted:
+        return (table, reason, 'No column to index found.')
+    for index, index_columns in sorted(indexes.items()):
+        if index_columns and index_columns[0] in wanted:
+            return (table, reason, 'Index {0} on ({1}) is not used; run '
+                    'ANALYZE or check the expression types.'.format(
+                        index, ', '.join(index_columns)))
+    return (table, reason, 'CREATE INDEX {0} ON {1} ({2});'.format(
+        quote_identifier('{0}_{1}_idx'.format(table, '_'.join(wanted))),
+        quote_identifier(table), ', '.join(map(quote_identifier, wanted))))
+
+
+def _plan_tree(rows, columns):
+    """Yield the (prefix, detail) of every step of a query plan, the prefix
+    drawing the tree like the sqlite3 shell does.
+
+    Since SQLite 3.24 every step has an id and the id of its parent; older
+    versions report a flat list.
+    """
+    children = {}
+    if columns[:2] == ['id', 'parent']:
+        for step_id, parent, _, detail in rows:
+            children.setdefault(parent, []).append((step_id, detail))
+    else:
+        children[0] = [(None, row[-1]) for row in rows]
+
+    def walk(parent, indent):
+        steps = children.get(parent, [])
+        for i, (step_id, detail) in enumerate(steps, 1):
+            last = i == len(steps)
+            yield indent + ('`--' if last else '|--'), detail
+            if step_id is not None:
+                for step in walk(step_id, indent + ('   ' if last else '|  ')):
+                    yield step
+
+    return walk(0, '')
+
+
+@special_command('\\explain', '\\explain query',
+                 'Show the query plan of a statement, with index hints.',
+                 arg_type=PARSED_QUERY, case_sensitive=True)
+def explain_query(cur, arg=None, **_):
+    """Show the query plan of *arg* as a tree, without running it.
+
+    Full table scans are shown in red, index searches in green and
+    temporary B-trees in yellow. Full scans and sorts are cross-referenced
+    with the columns and indexes of their tables to suggest indexes.
+    """
+    if not arg:
+        return [(None, None, None, 'Syntax: \\explain query')]
+    statement = arg.rstrip().rstrip(';')
+    cur.execute('EXPLAIN QUERY PLAN ' + statement)
+    columns = [c[0] for c in cur.description]
+    rows = cur.fetchall()
+
+    clauses = _clause_columns(statement)
+    filters = [ref for c in FILTER_CLAUSES for ref in clauses.get(c, [])]
+    ordering = [ref for c in ORDER_CLAUSES for ref in clauses.get(c, [])]
+
+    # Plans name the tables by their aliases since SQLite 3.36.
+    aliases = {}
+    for _, table, alias in extract_tables(statement):
+        aliases[(alias or table).lower()] = table
+
+    catalogs = _schema_catalogs(cur)
+    lines = ['QUERY PLAN']
+    hints = []
+    infos = {}
+    for prefix, detail in _plan_tree(rows, columns):
+        line = prefix + detail
+        match = PLAN_STEP_REGEX.match(detail)
+        if match:
+            kind, name, alias, rest = match.groups()
+            name = name.strip('"')
+            table = aliases.get(name.lower(), name)
+            qualifiers = (None, name.lower(), table.lower(),
+                          (alias or '').lower())
+            if table not in infos:
+                infos[table] = _table_info(catalogs, table)
+            info = infos[table]
+            if kind == 'SEARCH':
+                line = click.style(line, fg='green')
+            elif (info is not None and 'USING' not in rest and
+                    'VIRTUAL TABLE' not in rest):
+                line = click.style(line, fg='red')
+                refs = [(q, n) for q, n in filters if q in qualifiers]
+                hints.append(_index_hint(table, info, refs,
+                                         'Full table scan'))
+        elif 'TEMP B-TREE' in detail:
+            line = click.style(line, fg='yellow')
+            tables = [t for t, info in infos.items() if info is not None]
+            if len(tables) == 1:
+                # The sort could be avoided with an index on the columns
+                # the rows are ordered by.
+                hints.append(_index_hint(tables[0], infos[tables[0]],
+                                         ordering, 'Temporary B-tree'))
+            else:
+                hints.append(('', 'Temporary B-tree',
+                              'The rows of several tables are sorted.'))
+        lines.append(line)
+
+    if not hints:
+        return [('\n'.join(lines), None, None, 'No problems found.')]
+    return [('\n'.join(lines), hints, ['Table', 'Problem', 'Hint'],
+             '{0} problem{1} found.'.format(
+                 len(hints), '' if len(hints) == 1 else 's'))]
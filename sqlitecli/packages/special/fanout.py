@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""Run a query against many database files at once."""
+
+from __future__ import unicode_literals
+
+import glob
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+from sqlitecli.encodingutils import integer_types, text_type
+from .main import special_command, PARSED_QUERY
+
+log = logging.getLogger(__name__)
+
+MERGE_MODES = ('concat', 'sum', 'merge')
+
+# Number of files queried at the same time by the concat and sum modes.
+FANOUT_JOBS = 8
+
+# Number of rows the readers fetch and pass on at a time, and the number of
+# these batches each of them can get ahead of the output.
+BATCH_SIZE = 500
+QUEUED_BATCHES = 4
+
+# What a reader passes on after its last batch.
+_DONE = object()
+
+
+def _is_number(value):
+    return (isinstance(value, integer_types + (float, )) and
+            not isinstance(value, bool))
+
+
+def _sort_key(value):
+    """Order values like SQLite does: NULL, numbers, text, blobs.
+
+    >>> sorted([b'x', 'b', 2.5, None, 1], key=_sort_key) == [
+    ...     None, 1, 2.5, 'b', b'x']
+    True
+
+    """
+    if value is None:
+        return (0, 0)
+    elif _is_number(value):
+        return (1, value)
+    elif isinstance(value, text_type):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def _add(total, value):
+    """Add up two values of a column, ignoring NULLs and keeping the first
+    value of columns that aren't numbers.
+
+    >>> _add(None, 2), _add(1, 2), _add('a', 'b') == 'a'
+    (2, 3, True)
+
+    """
+    if total is None:
+        return value
+    elif _is_number(total) and _is_number(value):
+        return total + value
+    return total
+
+
+class ShardReader(threading.Thread):
+    """Run the query on one database file and queue up its rows.
+
+    The connection is opened read-only in the thread itself. sqlite3
+    releases the GIL while it steps through a statement, so the files are
+    read in parallel.
+    """
+
+    def __init__(self, filename, query, queue, stop, changed, slots=None):
+        threading.Thread.__init__(self, name='fanout')
+        self.setDaemon(True)
+        self.filename = filename
+        self.query = query
+        self.queue = queue
+        self.stop = stop
+        # Set when the query has been executed, failed or the thread is done.
+        self.changed = changed
+        self.slots = slots
+        self.description = None
+        self.error = None
+        self.finished = False
+        self.conn = None
+
+    def put(self, item):
+        """Queue *item* unless the output has been stopped meanwhile."""
+        while not self.stop.is_set():
+            try:
+                self.queue.put((self, item), timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def interrupt(self):
+        conn = self.conn
+        if conn is not None:
+            conn.interrupt()
+
+    def run(self):
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            self._read()
+        except sqlite3.Error as e:
+            self.error = sqlite3.OperationalError(
+                '{0}: {1}'.format(self.filename, e))
+            self.put(self.error)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+            self.finished = True
+            self.changed.set()
+
+    def _read(self):
+        # Imported here, it imports this package.
+        from sqlitecli.sqlexecute import SQLExecute
+
+        if self.stop.is_set():
+            return
+        executor = SQLExecute(self.filename, read_only=True)
+        self.conn = executor.conn
+        try:
+            cur = self.conn.cursor()
+            cur.execute(self.query)
+            self.description = cur.description
+            self.changed.set()
+            while True:
+                rows = cur.fetchmany(BATCH_SIZE)
+                if rows and not self.put(rows):
+                    return
+                if len(rows) < BATCH_SIZE:
+                    break
+            self.put(_DONE)
+        finally:
+            self.conn = None
+            executor.conn.close()
+
+
+class FanoutResult(object):
+    """The rows of a query run against many database files, merged.
+
+    It has the fetchmany()/fetchall() interface of a cursor, so the result
+    is read ahead, timed and rendered like the result of any other query.
+    """
+
+    def __init__(self, filenames, query, mode='concat', key=None,
+                 jobs=FANOUT_JOBS, shard_column=False):
+        self.filenames = filenames
+        self.mode = mode
+        self.key = key or []
+        self.shard_column = shard_column
+        self.stop = threading.Event()
+        self.changed = threading.Event()
+
+        # An ordered merge needs a row from every file, so all of them are
+        # read at once, each into a queue of its own.
+        if mode == 'merge':
+            slots, queues = None, [Queue(QUEUED_BATCHES) for _ in filenames]
+        else:
+            slots = threading.Semaphore(max(jobs, 1))
+            queues = [Queue(QUEUED_BATCHES * max(jobs, 1))] * len(filenames)
+        self.readers = [ShardReader(filename, query, queue, self.stop,
+                                    self.changed, slots)
+                        for filename, queue in zip(filenames, queues)]
+        try:
+            for reader in self.readers:
+                reader.start()
+            self.headers = self._headers()
+        except BaseException:
+            # E.g. Ctrl-C while waiting for the first file to be queried.
+            self.close()
+            raise
+        self._rows = self._merged_rows()
+
+    def _headers(self):
+        # The first file the query runs on decides the headers, the others
+        # must have the same columns.
+        while True:
+            self.changed.clear()
+            described = [reader for reader in self.readers
+                         if reader.description is not None]
+            if described:
+                break
+            if all(reader.finished for reader in self.readers):
+                self.close()
+                for reader in self.readers:
+                    if reader.error is not None:
+                        raise reader.error
+                return None
+            self.changed.wait(0.1)
+        headers = [column[0] for column in described[0].description]
+
+        missing = [name for name in self.key if name not in headers]
+        if missing:
+            self.close()
+            raise sqlite3.OperationalError(
+                'No such key column: {0}'.format(', '.join(missing)))
+        if self.shard_column:
+            headers.insert(0, 'shard')
+        return headers
+
+    def close(self):
+        """Stop reading, e.g. when the output has been cancelled."""
+        self.stop.set()
+        for reader in self.readers:
+            reader.interrupt()
+
+    def _batches(self, queue, readers):
+        """Yield the batches of rows of *readers* from *queue* until they
+        are all done."""
+        pending = len(readers)
+        while pending:
+            reader, item = queue.get()
+            if item is _DONE:
+                pending -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                if self.shard_column:
+                    item = [(reader.filename, ) + tuple(row) for row in item]
+                yield item
+
+    def _rows_of(self, reader):
+        for batch in self._batches(reader.queue, [reader]):
+            for row in batch:
+                yield row
+
+    def _merged_rows(self):
+        try:
+            if self.headers is None:
+                return
+            if self.mode == 'merge':
+                rows = self._ordered_merge()
+            else:
+                queue = self.readers[0].queue
+                rows = itertools.chain.from_iterable(
+                    self._batches(queue, self.readers))
+                if self.mode == 'sum':
+                    rows = self._sum(rows)
+            for row in rows:
+                yield row
+        finally:
+            self.close()
+
+    def _ordered_merge(self):
+        """Merge the rows of the files, each in ascending order of the
+        key."""
+        positions = [self.headers.index(name) for name in self.key]
+
+        def keyed(i, reader):
+            for n, row in enumerate(self._rows_of(reader)):
+                yield ([_sort_key(row[p]) for p in positions], i, n, row)
+
+        merged = heapq.merge(*[keyed(i, reader)
+                               for i, reader in enumerate(self.readers)])
+        return (row for _, _, _, row in merged)
+
+    def _sum(self, rows):
+        """Add up the rows with the same key, column by column."""
+        positions = [self.headers.index(name) for name in self.key]
+        totals = OrderedDict()
+        for row in rows:
+            key = tuple(row[p] for p in positions)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = list(row)
+            else:
+                totals[key] = [value if i in positions else _add(value, new)
+                               for i, (value, new) in enumerate(
+                                   zip(total, row))]
+        return (tuple(total) for total in totals.values())
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._rows, size))
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+def parse_fanout_args(arg):
+    """Split the arguments of \\fanout into its options, the file pattern
+    and the query, which is left as it is.
+
+    >>> opts, pattern, query = parse_fanout_args("-m merge -k day *.db SELECT 'a  b'")
+    >>> opts == {'-m': 'merge', '-k': 'day'}
+    True
+    >>> print(pattern)
+    *.db
+    >>> print(query)
+    SELECT 'a  b'
+
+    """
+    opts = {}
+    rest = arg.strip()
+    while rest.startswith('-'):
+        flag, _, rest = rest.partition(' ')
+        rest = rest.lstrip()
+        if flag in ('-m', '-k', '-j'):
+            opts[flag], _, rest = rest.partition(' ')
+            rest = rest.lstrip()
+        elif flag == '-s':
+            opts[flag] = True
+        else:
+            raise ValueError('Unknown option {0}'.format(flag))
+    pattern, _, query = rest.partition(' ')
+    if not pattern or not query.strip():
+        raise ValueError('A file pattern and a query are required.')
+    return opts, pattern, query.strip()
+
+
+@special_command('\\fanout',
+                 '\\fanout [-m mode] [-k col,..] [-j jobs] [-s] pattern query',
+                 'Run a read-only query on every database file matching a '
+                 'pattern.', arg_type=PARSED_QUERY, case_sensitive=True)
+def fanout(cur, arg=None, **_):
+    """Run a query on each of the files matching a glob pattern, one
+    connection and thread each, and output the merged rows."""
+    usage = ('Syntax: \\fanout [-m mode] [-k col,..] [-j jobs] [-s] pattern '
+             'query.\n'
+             '    * mode: concat (the default) outputs the rows of the files '
+             'as they are read,\n'
+             '      sum adds up the columns of the rows with the same key '
+             '(e.g. counts and sums),\n'
+             '      merge merges the rows of files that are ordered by the '
+             'key (ascending).\n'
+             '    * col: The key columns.\n'
+             '    * jobs: The number of files read at a time (default: {0}).\n'
+             '    * -s: Add a column with the file of each row.\n'
+             ).format(FANOUT_JOBS)
+    try:
+        opts, pattern, query = parse_fanout_args(arg or '')
+        mode = opts.get('-m', 'concat')
+        key = [name for name in opts.get('-k', '').split(',') if name]
+        jobs = int(opts.get('-j', FANOUT_JOBS))
+    except ValueError:
+        return [(None, None, None, usage)]
+    if mode not in MERGE_MODES or (mode == 'merge' and not key):
+        return [(None, None, None, usage)]
+
+    filenames = sorted(glob.glob(os.path.expanduser(pattern)))
+    if not filenames:
+        return [(None, None, None,
+                 'No database file matches {0}.'.format(pattern))]
+
+    log.debug('Fanning out %r to %d files.', query, len(filenames))
+    result = FanoutResult(filenames, query, mode=mode, key=key, jobs=jobs,
+                          shard_column='-s' in opts)
+    status = '{0} file{1}'.format(len(filenames),
+                                  '' if len(filenames) == 1 else 's')
+    if result.headers is None:
+        return [(None, None, None, 'Query OK, ' + status)]
+    return [(None, result, result.headers, status)]
@@ -1,16 +1,29 @@
 import os
 import re
+import csv
+import json
+import getopt
 import locale
 import logging
+import numbers
+import itertools
 import subprocess
 import shlex
+import sqlite3
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
 from io import open
-from time import sleep
+from time import sleep, time
+
+import binascii
 
 import click
-import sqlparse
 
+from sqlitecli.compat import PY2, reraise
+from sqlitecli.encodingutils import blob_types, text_type
 from sqlitecli.packages.prompt_utils import confirm_destructive_query
+from sqlitecli.packages.parseutils import quote_identifier, split_statements
 from . import export
 from .main import special_command, NO_QUERY, PARSED_QUERY
 from .favoritequeries import favoritequeries
@@ -20,7 +33,10 @@ TIMING_ENABLED = False
 use_expanded_output = False
 PAGER_ENABLED = True
 tee_file = None
-once_file = written_to_once_file = None
+once_file = None
+
+# Size of the write buffer of the tee and once files.
+OUTPUT_BUFFER_SIZE = 1 << 16
 
 @export
 def set_timing_enabled(val):
@@ -93,12 +109,13 @@ def editor_command(command):
     """
     # It is possible to have `\e filename` or `SELECT * FROM \e`. So we check
     # for both conditions.
-    return command.strip().endswith('\\e') or command.strip().startswith('\\e')
+    command = command.strip()
+    return command.endswith('\\e') or command.split(None, 1)[:1] == ['\\e']
 
 @export
 def get_filename(sql):
-    if sql.strip().startswith('\\e'):
-        command, _, filename = sql.partition(' ')
+    if sql.split(None, 1)[:1] == ['\\e']:
+        command, _, filename = sql.strip().partition(' ')
         return filename.strip() or None
 
 
@@ -174,7 +191,7 @@ def execute_favorite_query(cur, arg, **_):
         if arg_error:
             yield (None, None, None, arg_error)
         else:
-            for sql in sqlparse.split(query):
+            for sql in split_statements(query):
                 sql = sql.rstrip(';')
                 title = '> %s' % (sql)
                 cur.execute(sql)
@@ -291,15 +308,483 @@ def parseargfile(arg):
     return {'file': os.path.expanduser(filename), 'mode': mode}
 
 
+FILE_FORMATS = ('csv', 'tsv', 'jsonl')
+
+# Number of rows inserted per transaction by \import.
+IMPORT_BATCH_SIZE = 50000
+
+# Number of rows fetched at a time by \export.
+EXPORT_BATCH_SIZE = 10000
+
+string_types = (text_type, str)
+
+_integer_regex = re.compile(r'^\s*[-+]?\d+\s*$')
+_real_regex = re.compile(r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$')
+# A word of a command line, with its quotes.
+_word_regex = re.compile(
+    r'''\s*((?:[^\s'"\\]|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)+)''')
+
+
+def _file_format(filename):
+    """Guess the format of a file to import or export from its extension."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.tsv', '.tab'):
+        return 'tsv'
+    elif ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def _read_delimited(filename, delimiter):
+    """Yield the rows of a delimited UTF-8 file as lists of strings."""
+    if PY2:
+        # The Python 2 csv module only reads bytes. It rejects NUL bytes, so
+        # the values of a row can be joined with them and decoded at once.
+        with open(filename, 'rb') as f:
+            for row in csv.reader(f, delimiter=delimiter):
+                row = '\0'.join(row).decode('utf-8').split('\0')
+                if row[0].startswith(u'\ufeff'):
+                    row[0] = row[0][1:]
+                yield row
+    else:
+        with open(filename, encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f, delimiter=delimiter):
+                yield row
+
+
+def _read_jsonl(filename):
+    """Yield the keys of the first object of a JSON lines file, and then
+    the values of each object as a list."""
+    columns = None
+    with open(filename, encoding='utf-8-sig') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if columns is None:
+                # Keep the keys of the first object in order.
+                obj = json.loads(line, object_pairs_hook=OrderedDict)
+                columns = list(obj)
+                yield columns
+            else:
+                obj = json.loads(line)
+            row = []
+            for column in columns:
+                value = obj.get(column)
+                if isinstance(value, (dict, list)):
+                    value = json.dumps(value)
+                row.append(value)
+            yield row
+
+
+def _read_batch(rows, width, size):
+    """Read up to *size* rows, padded or truncated to *width* values."""
+    return [row if len(row) == width else (row + [None] * width)[:width]
+            for row in itertools.islice(rows, size)]
+
+
+def _value_type(value):
+    if isinstance(value, string_types):
+        if _integer_regex.match(value):
+            return 'INTEGER'
+        elif _real_regex.match(value):
+            return 'REAL'
+    elif isinstance(value, numbers.Integral):
+        return 'INTEGER'
+    elif isinstance(value, numbers.Real):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _infer_types(width, rows):
+    """Guess the type of each of the *width* columns from a sample of rows.
+
+    Values are inserted as read; SQLite's type affinity converts them to
+    the declared type of their column.
+    """
+    order = ['INTEGER', 'REAL', 'TEXT']
+    types = [None] * width
+    for row in rows:
+        for i, value in enumerate(row):
+            if value is None or value == '' or types[i] == 'TEXT':
+                continue
+            kind = _value_type(value)
+            if types[i] is None or order.index(kind) > order.index(types[i]):
+                types[i] = kind
+    return [kind or 'TEXT' for kind in types]
+
+
+@contextmanager
+def _tuned_for_import(cur):
+    """Trade durability for speed while importing.
+
+    The journal is kept in memory (unless the database uses WAL) and SQLite
+    doesn't wait for writes to reach the disk. The previous settings are
+    restored afterwards. Inside a transaction, where SQLite doesn't allow
+    changing them, they're left as they are.
+    """
+    journal_mode = cur.execute('PRAGMA journal_mode').fetchone()[0]
+    synchronous = cur.execute('PRAGMA synchronous').fetchone()[0]
+    try:
+        cur.execute('PRAGMA synchronous = OFF')
+    except sqlite3.OperationalError:
+        yield
+        return
+    if journal_mode != 'wal':
+        cur.execute('PRAGMA journal_mode = MEMORY')
+    try:
+        yield
+    finally:
+        cur.execute('PRAGMA synchronous = {0:d}'.format(synchronous))
+        if journal_mode != 'wal':
+            cur.execute('PRAGMA journal_mode = {0}'.format(journal_mode))
+
+
+@contextmanager
+def _savepoint(cur, name):
+    """Run the statements of the context in a savepoint.
+
+    Outside of a transaction the savepoint is a transaction of its own,
+    inside one (e.g. opened by the user) its changes become part of it. If
+    the context fails its changes are rolled back, and its error is raised
+    even if rolling back fails too.
+    """
+    cur.execute('SAVEPOINT {0}'.format(name))
+    try:
+        yield
+    except BaseException:
+        exc_info = sys.exc_info()
+        try:
+            cur.execute('ROLLBACK TO {0}'.format(name))
+            cur.execute('RELEASE {0}'.format(name))
+        except sqlite3.Error:
+            # An interrupted statement may have rolled back the
+            # transaction already.
+            pass
+        reraise(*exc_info)
+    cur.execute('RELEASE {0}'.format(name))
+
+
+@contextmanager
+def _explicit_transactions(conn):
+    """Stop sqlite3 from managing the transactions of *conn*.
+
+    With an isolation level set, sqlite3 before Python 3.6 commits before
+    statements like SAVEPOINT and CREATE TABLE, and begins a transaction of
+    its own before INSERTs. Unsetting the isolation level commits the
+    transaction it may have begun.
+    """
+    isolation_level = conn.isolation_level
+    if isolation_level is None or sys.version_info >= (3, 6):
+        yield
+        return
+    conn.isolation_level = None
+    try:
+        yield
+    finally:
+        conn.isolation_level = isolation_level
+
+
+@special_command('\\import', '\\import [-f format] [-t col:type,..] filename table',
+                 'Import a CSV, TSV or JSON lines file into a table.',
+                 case_sensitive=True)
+def import_file(cur, arg, **_):
+    """Import a file into a table, creating the table if needed.
+
+    The first line of a delimited file holds the column names, the keys of
+    the first object of a JSON lines file are used as column names. When
+    the table is created, the column types are guessed from the first
+    batch of rows, unless they are given with -t. The rows are streamed
+    and inserted in batches of IMPORT_BATCH_SIZE, one transaction each,
+    unless a transaction is open already, which the batches become part of.
+    """
+    usage = ('Syntax: \\import [-f format] [-t col:type,..] [-b batch_size] '
+             'filename table.\n'
+             '    * format: One of {0}. Guessed from the file extension by '
+             'default.\n'
+             '    * col:type: The type of a column of a new table. Guessed '
+             'from the data by default.\n').format(', '.join(FILE_FORMATS))
+
+    try:
+        opts, args = getopt.getopt(shlex.split(arg), 'f:t:b:')
+        opts = dict(opts)
+        filename, table = args
+        fmt = opts.get('-f')
+        batch_size = int(opts.get('-b', IMPORT_BATCH_SIZE))
+        types = dict(item.split(':', 1)
+                     for item in opts.get('-t', '').split(',') if item)
+    except (getopt.GetoptError, ValueError):
+        return [(None, None, None, usage)]
+
+    filename = os.path.expanduser(filename)
+    fmt = fmt or _file_format(filename)
+    if fmt not in FILE_FORMATS or batch_size < 1:
+        return [(None, None, None, usage)]
+
+    if fmt == 'jsonl':
+        rows = _read_jsonl(filename)
+    else:
+        rows = _read_delimited(filename, ',' if fmt == 'csv' else '\t')
+
+    start = time()
+    count = 0
+    try:
+        columns = next(rows, None)
+        if not columns:
+            return [(None, None, None, 'Nothing to import.')]
+        batch = _read_batch(rows, len(columns), batch_size)
+
+        statements = []
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND "
+                    "name = ?", (table,))
+        if cur.fetchone() is None:
+            inferred = _infer_types(len(columns), batch)
+            statements.append('CREATE TABLE {0} ({1})'.format(
+                quote_identifier(table),
+                ', '.join('{0} {1}'.format(quote_identifier(column),
+                                           types.get(column, kind))
+                          for column, kind in zip(columns, inferred))))
+
+        insert = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            quote_identifier(table),
+            ', '.join(quote_identifier(column) for column in columns),
+            ', '.join('?' * len(columns)))
+
+        with _explicit_transactions(cur.connection), _tuned_for_import(cur):
+            while batch or statements:
+                with _savepoint(cur, 'import'):
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.executemany(insert, batch)
+                statements = []
+                count += len(batch)
+                batch = _read_batch(rows, len(columns), batch_size)
+    except (IOError, OSError) as e:
+        return [(None, None, None, "Cannot read file '{}': {}".format(
+            e.filename, e.strerror))]
+    except (ValueError, csv.Error) as e:
+        return [(None, None, None, 'Import failed after {0} rows: {1}'.format(
+            count, e))]
+
+    status = 'Imported {0} row{1} into {2} in {3:.2f}s.'.format(
+        count, '' if count == 1 else 's', table, time() - start)
+    return [(None, None, None, status)]
+
+
+def _json_default(value):
+    """Encode blobs as hexadecimal strings."""
+    if isinstance(value, blob_types):
+        return binascii.hexlify(bytes(value)).decode('ascii')
+    raise TypeError('{0!r} is not JSON serializable'.format(value))
+
+
+def _write_delimited(f, cur, delimiter, batch_size, progress):
+    writer = csv.writer(f, delimiter=delimiter)
+    writer.writerow([d[0] for d in cur.description])
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        writer.writerows(rows)
+        progress(len(rows))
+
+
+def _write_jsonl(f, cur, batch_size, progress):
+    headers = [d[0] for d in cur.description]
+    encode = json.JSONEncoder(default=_json_default).encode
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        # Keep the columns in order, dicts don't on Python 2.
+        lines = '\n'.join(encode(OrderedDict(zip(headers, row)))
+                          for row in rows)
+        if not isinstance(lines, bytes):
+            lines = lines.encode('utf-8')
+        f.write(lines + b'\n')
+        progress(len(rows))
+
+
+def _parse_leading_args(arg, shortopts):
+    """Parse the options and the first argument of *arg* like \\import
+    does, and return them with the rest of *arg* as is, e.g. a query with
+    quotes of its own. Raise getopt.GetoptError or ValueError if there's no
+    such argument.
+
+    >>> _parse_leading_args("-f csv 'my file.csv' SELECT 'a b'", 'f:')
+    ([('-f', 'csv')], 'my file.csv', "SELECT 'a b'")
+    """
+    words = []
+    pos = 0
+    while True:
+        match = _word_regex.match(arg, pos)
+        if match is None:
+            raise ValueError('missing argument')
+        pos = match.end()
+        words.extend(shlex.split(match.group(1)))
+        try:
+            opts, args = getopt.getopt(words, shortopts)
+        except getopt.GetoptError:
+            # An option without its argument so far.
+            continue
+        if args:
+            return opts, args[0], arg[pos:].strip()
+
+
+@special_command('\\export', '\\export [-f format] filename query',
+                 'Write the result of a query to a CSV, TSV or JSON lines file.',
+                 case_sensitive=True)
+def export_query(cur, arg, **_):
+    """Write the rows of a query straight from the cursor to a file.
+
+    The rows are fetched EXPORT_BATCH_SIZE at a time and written through a
+    large buffer, bypassing the output formatter, pager, tee and once
+    files. The number of rows written so far is shown on stderr.
+    """
+    usage = ('Syntax: \\export [-f format] filename query.\n'
+             '    * format: One of {0}. Guessed from the file extension by '
+             'default.\n').format(', '.join(FILE_FORMATS))
+
+    try:
+        opts, filename, query = _parse_leading_args(arg, 'f:')
+    except (getopt.GetoptError, ValueError):
+        return [(None, None, None, usage)]
+    query = query.rstrip(';')
+    if not filename or not query:
+        return [(None, None, None, usage)]
+
+    filename = os.path.expanduser(filename)
+    fmt = dict(opts).get('-f') or _file_format(filename)
+    if fmt not in FILE_FORMATS:
+        return [(None, None, None, usage)]
+
+    show_progress = click.get_text_stream('stderr').isatty()
+    count = [0]
+    line = ['']
+
+    def progress(rows):
+        count[0] += rows
+        if show_progress:
+            line[0] = '{0:,} rows written'.format(count[0])
+            click.echo('\r' + line[0], nl=False, err=True)
+
+    start = time()
+    text_factory = cur.connection.text_factory
+    if PY2 and fmt != 'jsonl':
+        # The Python 2 csv module only writes bytes: fetch the UTF-8 text
+        # as is rather than decoding and encoding it again.
+        cur.connection.text_factory = str
+    try:
+        cur.execute(query)
+        if cur.description is None:
+            return [(None, None, None, 'The query returned no rows.')]
+
+        if PY2 or fmt == 'jsonl':
+            f = open(filename, 'wb', buffering=1 << 20)
+        else:
+            f = open(filename, 'w', encoding='utf-8', newline='',
+                     buffering=1 << 20)
+        with f:
+            if fmt == 'jsonl':
+                _write_jsonl(f, cur, EXPORT_BATCH_SIZE, progress)
+            else:
+                _write_delimited(f, cur, ',' if fmt == 'csv' else '\t',
+                                 EXPORT_BATCH_SIZE, progress)
+    except (IOError, OSError) as e:
+        return [(None, None, None, "Cannot write to file '{}': {}".format(
+            e.filename, e.strerror))]
+    finally:
+        cur.connection.text_factory = text_factory
+        if line[0]:
+            click.echo('\r' + ' ' * len(line[0]) + '\r', nl=False, err=True)
+
+    status = 'Exported {0} row{1} to {2} in {3:.2f}s.'.format(
+        count[0], '' if count[0] == 1 else 's', filename, time() - start)
+    return [(None, None, None, status)]
+
+
+class OutputSink(object):
+    """A file that output lines are copied to.
+
+    The file is opened on the first write and stays open until close(), and
+    writes go through a buffer that is only flushed by flush() or when it's
+    full. The number of lines and bytes written are counted.
+
+    >>> before = get_output_counters()
+    >>> sink = OutputSink(os.devnull, 'w')
+    >>> sink.write('abc')
+    >>> sink.write('\x1b[31mdef\x1b[0m')
+    >>> sink.close()
+    >>> sink.lines, sink.bytes
+    (2, 8)
+    >>> [after - b for after, b in zip(get_output_counters(), before)]
+    [2, 8]
+
+    """
+
+    # Lines and bytes written to all sinks.
+    total_lines = 0
+    total_bytes = 0
+
+    def __init__(self, file, mode):
+        self.filename = file
+        self.mode = mode
+        self.file = None
+        self.lines = 0
+        self.bytes = 0
+
+    def open(self):
+        if self.file is None:
+            try:
+                self.file = open(self.filename, self.mode + 'b',
+                                 buffering=OUTPUT_BUFFER_SIZE)
+            except (IOError, OSError) as e:
+                raise OSError("Cannot write to file '{}': {}".format(
+                    e.filename, e.strerror))
+
+    def write(self, output):
+        """Write the line *output*, without its styling."""
+        if '\x1b' in output:
+            output = click.unstyle(output)
+        data = (output + u'\n').encode('utf-8')
+        self.open()
+        self.file.write(data)
+        self.lines += 1
+        self.bytes += len(data)
+        OutputSink.total_lines += 1
+        OutputSink.total_bytes += len(data)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+@export
+def get_output_counters():
+    """Return the number of lines and bytes written to tee and once files."""
+    return OutputSink.total_lines, OutputSink.total_bytes
+
+
+@export
+def flush_output():
+    """Flush the tee file, e.g. at the end of a statement."""
+    if tee_file:
+        tee_file.flush()
+
+
 @special_command('tee', 'tee [-o] filename',
                  'Append all results to an output file (overwrite using -o).')
 def set_tee(arg, **_):
     global tee_file
 
-    try:
-        tee_file = open(**parseargfile(arg))
-    except (IOError, OSError) as e:
-        raise OSError("Cannot write to file '{}': {}".format(e.filename, e.strerror))
+    sink = OutputSink(**parseargfile(arg))
+    sink.open()
+    close_tee()
+    tee_file = sink
 
     return [(None, None, None, "")]
 
@@ -318,11 +803,8 @@ def no_tee(arg, **_):
 
 @export
 def write_tee(output):
-    global tee_file
     if tee_file:
-        click.echo(output, file=tee_file, nl=False)
-        click.echo(u'\n', file=tee_file, nl=False)
-        tee_file.flush()
+        tee_file.write(output)
 
 
 @special_command('\\once', '\\o [-o] filename',
@@ -331,33 +813,31 @@ def write_tee(output):
 def set_once(arg, **_):
     global once_file
 
-    once_file = parseargfile(arg)
+    sink = OutputSink(**parseargfile(arg))
+    if once_file:
+        once_file.close()
+    once_file = sink
 
     return [(None, None, None, "")]
 
 
 @export
 def write_once(output):
-    global once_file, written_to_once_file
-    if output and once_file:
+    global once_file
+    if once_file:
         try:
-            f = open(**once_file)
-        except (IOError, OSError) as e:
+            once_file.write(output)
+        except OSError:
             once_file = None
-            raise OSError("Cannot write to file '{}': {}".format(
-                e.filename, e.strerror))
-
-        with f:
-            click.echo(output, file=f, nl=False)
-            click.echo(u"\n", file=f, nl=False)
-        written_to_once_file = True
+            raise
 
 
 @export
 def unset_once_if_written():
-    """Unset the once file, if it has been written to."""
+    """Close and unset the once file, if it has been written to."""
     global once_file
-    if written_to_once_file:
+    if once_file and once_file.lines:
+        once_file.close()
         once_file = None
 
 
@@ -403,7 +883,7 @@ def watch_query(arg, **kwargs):
     cur = kwargs['cur']
     sql_list = [
         (sql.rstrip(';'), "> {0!s}".format(sql))
-        for sql in sqlparse.split(statement)
+        for sql in split_statements(statement)
     ]
     old_pager_enabled = is_pager_enabled()
     while True:
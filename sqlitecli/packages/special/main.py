@@ -26,6 +26,12 @@ def parse_special_command(sql):
     command = command.strip().replace('+', '')
     return (command, verbose, arg.strip())
 
+@export
+def is_special_command(sql):
+    """Check whether *sql* starts with the name of a special command."""
+    command = parse_special_command(sql)[0]
+    return command in COMMANDS or command.lower() in COMMANDS
+
 @export
 def special_command(command, shortcut, description, arg_type=PARSED_QUERY,
         hidden=False, case_sensitive=False, aliases=()):
@@ -45,3 +45,20 @@ def format_uptime(uptime_in_seconds):
 
     uptime = ' '.join(uptime_values)
     return uptime
+
+
+def format_size(size):
+    """Format a number of bytes into a human-readable string.
+
+    >>> print(format_size(1536))
+    1.5 KiB
+    >>> print(format_size(512))
+    512 bytes
+    """
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    if unit == 'bytes':
+        return '{0} {1}'.format(int(size), unit)
+    return '{0:.1f} {1}'.format(size, unit)
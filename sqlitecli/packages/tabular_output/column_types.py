@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Infer the types of the columns of a result set.
+
+sqlite3 doesn't report the types of the columns in cursor.description, so
+they are inferred from the values of the first window of rows, falling back
+to the declared type of the column when all of its sampled values are NULL.
+"""
+
+from __future__ import unicode_literals
+
+from sqlitecli.encodingutils import (binary_type, blob_types, integer_types,
+                                     text_type)
+
+# The types by generality, a column gets the most general type of its values.
+_TYPES = (type(None), int, float, binary_type, text_type)
+
+
+def _type_rank(value_type):
+    if value_type is type(None):
+        return 0
+    elif issubclass(value_type, integer_types):
+        return 1
+    elif issubclass(value_type, float):
+        return 2
+    elif issubclass(value_type, blob_types):
+        return 3
+    return 4
+
+
+def affinity_type(decltype):
+    """Get the type of a column from its declared type, by SQLite's rules
+    for column affinity. None is returned if the type can't be told.
+
+    >>> affinity_type('BIGINT') is int
+    True
+    >>> affinity_type('DOUBLE PRECISION') is float
+    True
+    >>> affinity_type('VARCHAR(20)') is text_type
+    True
+    >>> affinity_type('') is None
+    True
+
+    """
+    decltype = (decltype or '').upper()
+    if 'INT' in decltype:
+        return int
+    elif any(name in decltype for name in ('CHAR', 'CLOB', 'TEXT')):
+        return text_type
+    elif 'BLOB' in decltype or not decltype:
+        return None
+    elif any(name in decltype for name in ('REAL', 'FLOA', 'DOUB')):
+        return float
+    # NUMERIC affinity, which stores integers and reals.
+    return float
+
+
+def infer_column_types(rows, num_columns, declared_types=None):
+    """Get the type (int, float, binary or text) of each column of *rows*.
+
+    Columns whose values are all NULL get their type from
+    *declared_types*, a callable returning the affinity type of each column
+    (or None), which is only called when it is needed. Columns whose type
+    can't be told are typed as text.
+
+    >>> types = infer_column_types([(1, 1, 'a', None), (2, 2.5, 'b', None)], 4)
+    >>> types == [int, float, text_type, text_type]
+    True
+
+    """
+    ranks = [0] * num_columns
+    for i, column in enumerate(zip(*rows)):
+        # Only look at each distinct type once, most columns have one or two.
+        ranks[i] = max(_type_rank(t) for t in set(map(type, column)))
+
+    column_types = [_TYPES[rank] for rank in ranks]
+    if rows and declared_types is not None and 0 in ranks:
+        declared = declared_types()
+        for i, rank in enumerate(ranks):
+            if rank == 0 and declared and declared[i] is not None:
+                column_types[i] = declared[i]
+    return [text_type if t is type(None) else t for t in column_types]
@@ -1,56 +1,122 @@
 # -*- coding: utf-8 -*-
 """Format adapter for sql."""
 
-from cli_helpers.utils import filter_dict_by_key
-from sqlitecli.packages.parseutils import extract_tables
+from __future__ import unicode_literals
+
+import binascii
+import math
+
+from sqlitecli.encodingutils import blob_types, integer_types, text_type
+from sqlitecli.packages.parseutils import extract_tables, quote_identifier
 
 supported_formats = ('sql-insert', 'sql-update', 'sql-update-1',
                      'sql-update-2', )
 
 preprocessors = ()
 
+# Number of rows per INSERT statement of the sql-insert format.
+INSERT_ROWS = 1000
+
+def sql_literal(value):
+    """Quote *value* as an SQLite literal.
+
+    >>> print(sql_literal("it's"))
+    'it''s'
+    >>> print(sql_literal(None))
+    NULL
+    >>> print(sql_literal(float('inf')))
+    9e999
+    >>> print(sql_literal(b'\\x00\\xff'))
+    X'00ff'
+
+    """
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, text_type):
+        return "'" + value.replace("'", "''") + "'"
+    elif isinstance(value, bool):
+        return '1' if value else '0'
+    elif isinstance(value, integer_types):
+        return str(value)
+    elif isinstance(value, float):
+        if math.isnan(value):
+            return 'NULL'
+        elif math.isinf(value):
+            return '9e999' if value > 0 else '-9e999'
+        return repr(value)
+    elif isinstance(value, blob_types):
+        return "X'" + binascii.hexlify(bytes(value)).decode('ascii') + "'"
+    return sql_literal(text_type(value))
+
+
+def quote_column(values):
+    """Quote a column of values as SQLite literals.
 
-def adapter(data, headers, table_format=None, **kwargs):
-    tables = extract_tables(formatter.query)
+    Columns of integers or of text only (the common case) are quoted in
+    bulk, anything else value by value.
+    """
+    types = set(map(type, values))
+    if len(types) == 1:
+        value_type = types.pop()
+        if value_type in integer_types:
+            return list(map(str, values))
+        elif value_type is text_type:
+            return ["'" + v.replace("'", "''") + "'" for v in values]
+    return list(map(sql_literal, values))
+
+
+def quote_rows(rows):
+    """Quote a batch of rows column by column, and return the rows of
+    literals."""
+    if not rows:
+        return []
+    return list(zip(*[quote_column(column) for column in zip(*rows)]))
+
+
+def adapter(data, headers, table_format=None, insert_rows=INSERT_ROWS,
+            **kwargs):
+    tables = extract_tables(getattr(formatter, 'query', None) or '')
     if len(tables) > 0:
         table = tables[0]
         if table[0]:
-            table_name = "{}.{}".format(*table[:2])
+            table_name = '{}.{}'.format(quote_identifier(table[0]),
+                                        quote_identifier(table[1]))
         else:
-            table_name = table[1]
+            table_name = quote_identifier(table[1])
     else:
-        table_name = "`DUAL`"
-    escape = formatter.mycli.sqlexecute.conn.escape
+        table_name = quote_identifier('DUAL')
+    columns = [quote_identifier(h) for h in headers]
+    rows = quote_rows(list(data))
+
     if table_format == 'sql-insert':
-        h = "`, `".join(headers)
-        yield "INSERT INTO {} (`{}`) VALUES".format(table_name, h)
-        prefix = "  "
-        for d in data:
-            values = ", ".join(escape(v) for i, v in enumerate(d))
-            yield "{}({})".format(prefix, values)
-            if prefix == "  ":
-                prefix = ", "
-        yield ";"
+        insert = 'INSERT INTO {} ({}) VALUES'.format(table_name,
+                                                    ', '.join(columns))
+        for start in range(0, len(rows), insert_rows):
+            batch = rows[start:start + insert_rows]
+            yield insert
+            for i, row in enumerate(batch, 1):
+                yield '  ({}){}'.format(', '.join(row),
+                                        ';' if i == len(batch) else ',')
     if table_format.startswith('sql-update'):
         s = table_format.split('-')
         keys = 1
         if len(s) > 2:
             keys = int(s[-1])
-        for d in data:
-            yield "UPDATE {} SET".format(table_name)
-            prefix = "  "
-            for i, v in enumerate(d[keys:], keys):
-                yield "{}`{}` = {}".format(prefix, headers[i], escape(v))
-                if prefix == "  ":
-                    prefix = ", "
-            f = "`{}` = {}"
-            where = (f.format(headers[i], escape(d[i])) for i in range(keys))
-            yield "WHERE {};".format(" AND ".join(where))
-
-
-def register_new_formatter(TabularOutputFormatter):
+        for row in rows:
+            yield 'UPDATE {} SET'.format(table_name)
+            prefix = '  '
+            for i, v in enumerate(row[keys:], keys):
+                yield '{}{} = {}'.format(prefix, columns[i], v)
+                if prefix == '  ':
+                    prefix = ', '
+            where = ('{} = {}'.format(columns[i], row[i]) for i in range(keys))
+            yield 'WHERE {};'.format(' AND '.join(where))
+
+
+def register_new_formatter(TabularOutputFormatter, insert_rows=INSERT_ROWS):
     global formatter
     formatter = TabularOutputFormatter
     for sql_format in supported_formats:
         TabularOutputFormatter.register_new_formatter(
-            sql_format, adapter, preprocessors, {'table_format': sql_format})
+            sql_format, adapter, preprocessors,
+            {'table_format': sql_format, 'insert_rows': insert_rows})
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Render result sets in fixed-size row windows."""
+
+from __future__ import unicode_literals
+
+import itertools
+
+from sqlitecli.encodingutils import text_type
+
+# Formats whose output starts with a single header line, which is only
+# printed for the first window.
+delimited_formats = ('csv', 'csv-tab', 'tsv')
+
+
+def iter_windows(rows, size):
+    """Yield lists of at most *size* rows from *rows*.
+
+    Cursors are read with fetchmany() so that only one window is held in
+    memory at a time. At least one (possibly empty) window is always yielded.
+    If *size* is 0 or None, all of the rows are yielded as a single window.
+
+    >>> list(iter_windows(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    >>> list(iter_windows([], 2))
+    [[]]
+
+    """
+    if not size:
+        yield list(rows)
+        return
+
+    fetchmany = getattr(rows, 'fetchmany', None)
+    if fetchmany is None:
+        rows = iter(rows)
+        fetchmany = lambda n: list(itertools.islice(rows, n))
+
+    first = True
+    while True:
+        window = fetchmany(size)
+        if window or first:
+            yield window
+        if len(window) < size:
+            break
+        first = False
+
+
+def _vertical_separator(num):
+    """Get the separator that the vertical format puts before row *num*."""
+    return '{0}[ {1}. row ]{0}\n'.format('*' * 27, num)
+
+
+def format_windows(formatter, windows, headers, format_name=None, **kwargs):
+    """Format each window of rows and yield the output lines lazily.
+
+    Tabular formats get their column widths from the window being rendered,
+    so each window is printed as a table of its own. Delimited formats only
+    print the header line once, and the vertical format keeps numbering rows
+    across windows.
+
+    :param formatter: A TabularOutputFormatter.
+    :param iterable windows: An iterable of lists of rows.
+    :param headers: The column headers.
+    :param str format_name: The format to use (defaults to the formatter's).
+    :param \\*\\*kwargs: Passed on to formatter.format_output().
+
+    """
+    format_name = format_name or formatter.format_name
+    offset = 0
+    for i, window in enumerate(windows):
+        formatted = formatter.format_output(window, headers,
+                                            format_name=format_name, **kwargs)
+        if isinstance(formatted, text_type):
+            formatted = formatted.splitlines()
+        formatted = iter(formatted)
+
+        if i > 0 and format_name in delimited_formats:
+            # Skip the header line, it has already been printed.
+            next(formatted, None)
+
+        for num, line in enumerate(formatted, 1):
+            if offset and format_name == 'vertical':
+                separator = _vertical_separator(num)
+                if line.startswith(separator):
+                    line = _vertical_separator(offset + num) + line[len(separator):]
+            yield line
+
+        offset += len(window)
@@ -0,0 +1,99 @@
+"""Persist schema catalogs on disk, so that completions are available as soon
+as the client starts."""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+
+from .sqlexecute import Column, Index
+
+_logger = logging.getLogger(__name__)
+
+# Bump this whenever the layout of the catalog changes.
+CACHE_FORMAT = 1
+
+
+def cache_path(cache_dir, filename):
+    """Return the path of the cache file for database *filename*."""
+    if not isinstance(filename, bytes):
+        filename = filename.encode('utf-8')
+    key = hashlib.sha1(filename).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), key + '.json')
+
+
+def load(cache_dir, executor):
+    """Load the cached catalog of the main schema of *executor*'s database.
+
+    The cache is keyed on the database's path and inode. It is used as is if
+    the file's mtime hasn't changed, otherwise only if its schema version is
+    still the same.
+
+    Returns the catalog, or None if nothing valid is cached.
+    """
+    filename = executor.filename
+    if filename == ':memory:':
+        return None
+
+    try:
+        stat = os.stat(filename)
+        with open(cache_path(cache_dir, filename)) as f:
+            snapshot = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if (snapshot.get('format') != CACHE_FORMAT or
+            snapshot.get('path') != filename or
+            snapshot.get('inode') != stat.st_ino):
+        return None
+
+    catalog = snapshot['catalog']
+    if (snapshot.get('mtime') != stat.st_mtime and
+            catalog['version'] != executor.schema_version()):
+        return None
+
+    return _decode(catalog)
+
+
+def save(cache_dir, executor, catalog):
+    """Write *catalog* of the main schema of *executor*'s database to the
+    cache."""
+    filename = executor.filename
+    if filename == ':memory:':
+        return
+
+    path = cache_path(cache_dir, filename)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            _logger.error('Unable to create the schema cache: %s', e)
+            return
+
+    try:
+        stat = os.stat(filename)
+        snapshot = {'format': CACHE_FORMAT, 'path': filename,
+                    'inode': stat.st_ino, 'mtime': stat.st_mtime,
+                    'catalog': catalog}
+        # Write to a temporary file first, so that a concurrently starting
+        # client never reads a partially written cache.
+        tmp_path = '{0}.{1}'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        _logger.error('Unable to write the schema cache: %s', e)
+
+
+def _decode(catalog):
+    """Turn the JSON lists of a loaded catalog back into tuples."""
+    for kind in ('tables', 'views'):
+        catalog[kind] = dict(
+            (name, [Column(*column) for column in columns])
+            for name, columns in catalog[kind].items())
+    catalog['indexes'] = dict((name, Index(*index))
+                              for name, index in catalog['indexes'].items())
+    return catalog
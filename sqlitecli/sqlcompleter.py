@@ -1,11 +1,13 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 import logging
-from re import compile, escape
+import time
+from re import compile
 from collections import Counter
 
 from prompt_toolkit.completion import Completer, Completion
 
+from .packages.candidates import CandidateIndex, fuzzy_pattern
 from .packages.completion_engine import suggest_type
 from .packages.parseutils import last_word
 from .packages.special.favoritequeries import favoritequeries
@@ -119,15 +121,27 @@ class SQLCompleter(Completer):
         # dbmetadata.values() are the 'tables' and 'functions' dicts
         for metadata in self.dbmetadata.values():
             metadata[schema] = {}
+        for index in self.dbindex.values():
+            index[schema] = CandidateIndex()
         self.all_completions.update(schema)
 
-    def extend_relations(self, data, kind):
+    def drop_schema(self, schema):
+        """Remove *schema* and its tables, views and functions."""
+        for metadata in self.dbmetadata.values():
+            metadata.pop(schema, None)
+        for index in self.dbindex.values():
+            index.pop(schema, None)
+        self.attached.pop(schema, None)
+
+    def extend_relations(self, data, kind, schema=None):
         """Extend metadata for tables or views
 
         :param data: list of (rel_name, ) tuples
         :param kind: either 'tables' or 'views'
+        :param schema: the schema of the relations, the current one if None
         :return:
         """
+        schema = schema or self.dbname
         # 'data' is a generator object. It can throw an exception while being
         # consumed. This could happen if the user has launched the app without
         # specifying a database name. This exception must be handled to prevent
@@ -142,19 +156,22 @@ class SQLCompleter(Completer):
         metadata = self.dbmetadata[kind]
         for relname in data:
             try:
-                metadata[self.dbname][relname[0]] = ['*']
+                metadata[schema][relname[0]] = ['*']
+                self.dbindex[kind][schema].add(relname[0])
             except KeyError:
                 _logger.error('%r %r listed in unrecognized schema %r',
-                              kind, relname[0], self.dbname)
+                              kind, relname[0], schema)
             self.all_completions.add(relname[0])
 
-    def extend_columns(self, column_data, kind):
+    def extend_columns(self, column_data, kind, schema=None):
         """Extend column metadata
 
         :param column_data: list of (rel_name, column_name) tuples
         :param kind: either 'tables' or 'views'
+        :param schema: the schema of the relations, the current one if None
         :return:
         """
+        schema = schema or self.dbname
         # 'column_data' is a generator object. It can throw an exception while
         # being consumed. This could happen if the user has launched the app
         # without specifying a database name. This exception must be handled to
@@ -166,9 +183,43 @@ class SQLCompleter(Completer):
 
         metadata = self.dbmetadata[kind]
         for relname, column in column_data:
-            metadata[self.dbname][relname].append(column)
+            metadata[schema][relname].append(column)
             self.all_completions.add(column)
 
+    def update_relations(self, kind, relations, removed=(), schema=None):
+        """Add, replace or remove tables or views of a schema.
+
+        The schema's metadata and all_completions are swapped in one go, so
+        completions computed concurrently never see them half updated. Removed names are left in
+        all_completions, which is only used when smart completion is off.
+
+        :param kind: either 'tables' or 'views'
+        :param relations: list of (rel_name, [column_name, ...]) tuples
+        :param removed: list of rel_names to remove
+        :param schema: the schema of the relations, the current one if None
+        :return:
+        """
+        schema = schema or self.dbname
+        metadata = dict(self.dbmetadata[kind].get(schema, {}))
+        index = self.dbindex[kind].get(schema, CandidateIndex()).copy()
+        for relname in removed:
+            relname = self.escape_name(relname)
+            metadata.pop(relname, None)
+            index.discard(relname)
+
+        all_completions = self.all_completions.copy()
+        for relname, columns in relations:
+            relname = self.escape_name(relname)
+            columns = self.escaped_names(columns)
+            metadata[relname] = ['*'] + columns
+            index.add(relname)
+            all_completions.add(relname)
+            all_completions.update(columns)
+
+        self.dbmetadata[kind][schema] = metadata
+        self.dbindex[kind][schema] = index
+        self.all_completions = all_completions
+
     def extend_functions(self, func_data):
         # 'func_data' is a generator object. It can throw an exception while
         # being consumed. This could happen if the user has launched the app
@@ -185,6 +236,7 @@ class SQLCompleter(Completer):
 
         for func in func_data:
             metadata[self.dbname][func[0]] = None
+            self.dbindex['functions'][self.dbname].add(func[0])
             self.all_completions.add(func[0])
 
     def set_dbname(self, dbname):
@@ -195,8 +247,13 @@ class SQLCompleter(Completer):
         self.users = []
         self.show_items = []
         self.dbname = ''
+        # The files of the attached databases, keyed by schema name.
+        self.attached = {}
         self.dbmetadata = {'tables': {}, 'views': {}, 'functions': {}}
-        self.all_completions = set(self.keywords + self.functions)
+        # The names in dbmetadata, per kind and schema, indexed for
+        # find_matches().
+        self.dbindex = {'tables': {}, 'views': {}, 'functions': {}}
+        self.all_completions = CandidateIndex(self.keywords + self.functions)
 
     @staticmethod
     def find_matches(text, collection, start_only=False, fuzzy=True, casing=None):
@@ -210,6 +267,9 @@ class SQLCompleter(Completer):
         completion only at the beginning. Otherwise, a completion is
         considered a match if the text appears anywhere within it.
 
+        A CandidateIndex collection is searched through its index, any
+        other collection is scanned.
+
         yields prompt_toolkit Completion instances for any matches found
         in the collection of available completions.
         """
@@ -218,16 +278,17 @@ class SQLCompleter(Completer):
 
         completions = []
 
-        if fuzzy:
-            regex = '.*?'.join(map(escape, text))
-            pat = compile('(%s)' % regex)
-            for item in sorted(collection):
+        if isinstance(collection, CandidateIndex):
+            completions = collection.find(text, start_only, fuzzy)
+        elif fuzzy:
+            pat = fuzzy_pattern(text)
+            for item in collection:
                 r = pat.search(item.lower())
                 if r:
                     completions.append((len(r.group()), r.start(), item))
         else:
             match_end_limit = len(text) if start_only else None
-            for item in sorted(collection):
+            for item in collection:
                 match_point = item.lower().find(text, 0, match_end_limit)
                 if match_point >= 0:
                     completions.append((len(text), match_point, item))
@@ -244,6 +305,14 @@ class SQLCompleter(Completer):
                 for x, y, z in sorted(completions))
 
     def get_completions(self, document, complete_event, smart_completion=None):
+        completions = []
+        for group in self.iter_completion_groups(document, smart_completion):
+            completions.extend(group)
+        return completions
+
+    def iter_completion_groups(self, document, smart_completion=None):
+        """Yield the completions for *document*, one list per suggestion
+        type, so that callers can stop in between."""
         word_before_cursor = document.get_word_before_cursor(WORD=True)
         if smart_completion is None:
             smart_completion = self.smart_completion
@@ -251,10 +320,11 @@ class SQLCompleter(Completer):
         # If smart_completion is off then match any word that starts with
         # 'word_before_cursor'.
         if not smart_completion:
-            return self.find_matches(word_before_cursor, self.all_completions,
-                                     start_only=True, fuzzy=False)
+            yield list(self.find_matches(word_before_cursor,
+                                         self.all_completions,
+                                         start_only=True, fuzzy=False))
+            return
 
-        completions = []
         suggestions = suggest_type(document.text, document.text_before_cursor)
 
         for suggestion in suggestions:
@@ -275,14 +345,14 @@ class SQLCompleter(Completer):
                     ]
 
                 cols = self.find_matches(word_before_cursor, scoped_cols)
-                completions.extend(cols)
+                yield list(cols)
 
             elif suggestion['type'] == 'function':
                 # suggest user-defined functions using substring matching
                 funcs = self.populate_schema_objects(suggestion['schema'],
                                                      'functions')
                 user_funcs = self.find_matches(word_before_cursor, funcs)
-                completions.extend(user_funcs)
+                yield list(user_funcs)
 
                 # suggest hardcoded functions using startswith matching only if
                 # there is no schema qualifier. If a schema qualifier is
@@ -294,35 +364,41 @@ class SQLCompleter(Completer):
                                                          start_only=True,
                                                          fuzzy=False,
                                                          casing=self.keyword_casing)
-                    completions.extend(predefined_funcs)
+                    yield list(predefined_funcs)
 
             elif suggestion['type'] == 'table':
                 tables = self.populate_schema_objects(suggestion['schema'],
                                                       'tables')
                 tables = self.find_matches(word_before_cursor, tables)
-                completions.extend(tables)
+                yield list(tables)
 
             elif suggestion['type'] == 'view':
                 views = self.populate_schema_objects(suggestion['schema'],
                                                      'views')
                 views = self.find_matches(word_before_cursor, views)
-                completions.extend(views)
+                yield list(views)
 
             elif suggestion['type'] == 'alias':
                 aliases = suggestion['aliases']
                 aliases = self.find_matches(word_before_cursor, aliases)
-                completions.extend(aliases)
+                yield list(aliases)
+
+            elif suggestion['type'] == 'schema':
+                schemata = self.find_matches(word_before_cursor,
+                                             sorted(self.dbmetadata['tables']),
+                                             start_only=True, fuzzy=False)
+                yield list(schemata)
 
             elif suggestion['type'] == 'database':
                 dbs = self.find_matches(word_before_cursor, self.databases)
-                completions.extend(dbs)
+                yield list(dbs)
 
             elif suggestion['type'] == 'keyword':
                 keywords = self.find_matches(word_before_cursor, self.keywords,
                                              start_only=True,
                                              fuzzy=False,
                                              casing=self.keyword_casing)
-                completions.extend(keywords)
+                yield list(keywords)
 
             elif suggestion['type'] == 'show':
                 show_items = self.find_matches(word_before_cursor,
@@ -330,41 +406,39 @@ class SQLCompleter(Completer):
                                                start_only=False,
                                                fuzzy=True,
                                                casing=self.keyword_casing)
-                completions.extend(show_items)
+                yield list(show_items)
 
             elif suggestion['type'] == 'change':
                 change_items = self.find_matches(word_before_cursor,
                                                  self.change_items,
                                                  start_only=False,
                                                  fuzzy=True)
-                completions.extend(change_items)
+                yield list(change_items)
             elif suggestion['type'] == 'user':
                 users = self.find_matches(word_before_cursor, self.users,
                                           start_only=False,
                                           fuzzy=True)
-                completions.extend(users)
+                yield list(users)
 
             elif suggestion['type'] == 'special':
                 special = self.find_matches(word_before_cursor,
                                             self.special_commands,
                                             start_only=True,
                                             fuzzy=False)
-                completions.extend(special)
+                yield list(special)
             elif suggestion['type'] == 'favoritequery':
                 queries = self.find_matches(word_before_cursor,
                                             favoritequeries.list(),
                                             start_only=False, fuzzy=True)
-                completions.extend(queries)
+                yield list(queries)
             elif suggestion['type'] == 'table_format':
                 formats = self.find_matches(word_before_cursor,
                                             self.table_formats,
                                             start_only=True, fuzzy=False)
-                completions.extend(formats)
+                yield list(formats)
             elif suggestion['type'] == 'file_name':
                 file_names = self.find_files(word_before_cursor)
-                completions.extend(file_names)
-
-        return completions
+                yield list(file_names)
 
     def find_files(self, word):
         """Yield matching directory or file names.
@@ -419,14 +493,49 @@ class SQLCompleter(Completer):
         return columns
 
     def populate_schema_objects(self, schema, obj_type):
-        """Returns list of tables or functions for a (optional) schema"""
-        metadata = self.dbmetadata[obj_type]
+        """Returns the indexed tables or functions for a (optional) schema"""
         schema = schema or self.dbname
 
         try:
-            objects = metadata[schema].keys()
+            objects = self.dbindex[obj_type][schema]
         except KeyError:
             # schema doesn't exist
             objects = []
 
         return objects
+
+
+class CancellableCompleter(Completer):
+    """Wrap an SQLCompleter so its completions can be superseded.
+
+    prompt_toolkit computes completions in a worker thread, one request at a
+    time, and only starts the request for the latest text once the previous
+    one is done. Calling cancel() when the text changes makes the running
+    request give up after the suggestion type it's working on, so that the
+    next one starts right away. A request that takes more than *budget*
+    seconds stops early and shows the completions found so far.
+    """
+
+    def __init__(self, completer, budget=None):
+        self.completer = completer
+        self.budget = budget
+        self._generation = 0
+
+    def cancel(self):
+        """Supersede the completions being computed."""
+        self._generation += 1
+
+    def get_completions(self, document, complete_event):
+        generation = self._generation
+        start = time.time()
+        completions = []
+        for group in self.completer.iter_completion_groups(document):
+            if generation != self._generation:
+                _logger.debug('Completion request superseded.')
+                return []
+            completions.extend(group)
+            if self.budget and time.time() - start > self.budget:
+                _logger.debug('Completion budget exceeded, showing %d '
+                              'completions found so far.', len(completions))
+                break
+        return completions
@@ -1,20 +1,209 @@
 import os
 import logging
+import itertools
+import signal
 import sqlite3
-import pymysql
-import sqlparse
+import sys
+import threading
+import weakref
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from time import time
 from .packages import special
-from pymysql.constants import FIELD_TYPE
-from pymysql.converters import (convert_mysql_timestamp, convert_datetime,
-                                convert_timedelta, convert_date, conversions,
-                                decoders)
+from .packages.parseutils import (extract_tables, quote_identifier,
+                                  split_statements)
+from .packages.profiling import StatementProfile, timed
 
 _logger = logging.getLogger(__name__)
 
-FIELD_TYPES = decoders.copy()
-FIELD_TYPES.update({
-    FIELD_TYPE.NULL: type(None)
-})
+# Column metadata as reported by PRAGMA table_xinfo. *hidden* is 0 for normal
+# columns, 1 for hidden columns of virtual tables, 2 and 3 for generated
+# (virtual and stored) columns.
+Column = namedtuple('Column', ['name', 'type', 'notnull', 'default', 'pk',
+                               'hidden'])
+Index = namedtuple('Index', ['name', 'table', 'columns'])
+
+# sqlite3.connect() takes URIs from Python 3.4. Without them, read-only
+# connections fall back to PRAGMA query_only and in-memory databases can't be
+# shared between connections.
+URI_SUPPORTED = sys.version_info >= (3, 4)
+
+# Numbers the shared in-memory databases of the process.
+_memory_databases = itertools.count(1)
+
+class BufferedCursor(object):
+    """Wrap a cursor and read ahead up to *size* of its rows.
+
+    The rows that were read ahead are handed out first, so the result can be
+    inspected before it is rendered without executing the query again.
+    Everything else is delegated to the wrapped cursor.
+    """
+
+    def __init__(self, cursor, size):
+        self._cursor = cursor
+        self._buffer = cursor.fetchmany(size)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        rows, self._buffer = self._buffer, []
+        return itertools.chain(rows, self._cursor)
+
+    @property
+    def buffered(self):
+        """The number of rows that have been read ahead."""
+        return len(self._buffer)
+
+    def fetchmany(self, size):
+        rows, self._buffer = self._buffer[:size], self._buffer[size:]
+        if len(rows) < size:
+            rows.extend(self._cursor.fetchmany(size - len(rows)))
+        return rows
+
+    def fetchall(self):
+        rows, self._buffer = self._buffer, []
+        rows.extend(self._cursor.fetchall())
+        return rows
+
+
+class StatementCache(object):
+    """Track the statements run on a connection like the statement cache of
+    the sqlite3 module does.
+
+    sqlite3 keeps the last *size* statements prepared, in an LRU keyed by
+    the SQL text, but doesn't tell whether a statement was found there. This
+    LRU of the statement texts mirrors it to count the hits and misses of
+    the statements of the user.
+
+    Every use of a statement is queued with a serial number, and only the
+    entry of its last use counts when the oldest statements are evicted,
+    which keeps recording cheap enough for scripts.
+
+    >>> cache = StatementCache(2)
+    >>> for sql in ['a', 'b', 'a', 'c', 'b', 'a']:
+    ...     cache.record(sql)
+    >>> cache.hits, cache.misses, sorted(cache)
+    (1, 5, ['a', 'b'])
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._serial = 0
+        # {statement: serial of its last use}
+        self._statements = {}
+        self._uses = deque()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def __iter__(self):
+        return iter(list(self._statements))
+
+    def record(self, sql):
+        if sql in self._statements:
+            self.hits += 1
+        else:
+            self.misses += 1
+            if self.size <= 0:
+                return
+        self._serial += 1
+        self._statements[sql] = self._serial
+        self._uses.append((self._serial, sql))
+        while len(self._statements) > self.size:
+            serial, oldest = self._uses.popleft()
+            if self._statements[oldest] == serial:
+                del self._statements[oldest]
+        if len(self._uses) > 2 * self.size:
+            # Drop the uses that have been superseded.
+            self._uses = deque(sorted(
+                (serial, sql) for sql, serial in self._statements.items()))
+
+
+class Connection(sqlite3.Connection):
+    """A connection keeping the client side statistics shown by the status
+    command: when it was opened, and the number of queries run by the user,
+    the time spent executing them and how they fared in the statement
+    cache. Special commands, which only get a cursor,
+    find the schema catalogs of the connection through its executor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        sqlite3.Connection.__init__(self, *args, **kwargs)
+        self.statement_cache = StatementCache(
+            kwargs.get('cached_statements', 100))
+        self.opened = time()
+        self.queries = 0
+        self.execute_time = 0.0
+        # A weak reference to the SQLExecute the connection belongs to.
+        self.executor = lambda: None
+
+
+class ConnectionPool(object):
+    """A pool of read-only executors of a database, for background work such
+    as refreshing the completions.
+
+    Each executor has a connection of its own, which any thread can use.
+    Executors are created when they're needed, at most *size* at a time, and
+    are kept along with their schema catalogs when they're given back.
+
+    The *lock*, if given, is held while an executor is borrowed. The
+    statements of the user hold it as well on a shared in-memory database,
+    so they wait for a background read instead of failing:
+
+    >>> ex = SQLExecute(':memory:')
+    >>> _ = list(ex.run('CREATE TABLE a (x); CREATE TABLE b (x)'))
+    >>> reading, done = threading.Event(), threading.Event()
+    >>> def read():
+    ...     with ex.pool.executor() as reader:
+    ...         cur = reader.conn.execute('SELECT name FROM sqlite_master')
+    ...         cur.fetchone()
+    ...         reading.set()
+    ...         done.wait(0.2)
+    >>> thread = threading.Thread(target=read)
+    >>> thread.start()
+    >>> _ = reading.wait(5)
+    >>> [status for _, _, _, status in ex.run('CREATE TABLE c (x)')]
+    ['Query OK, -1 rows affected']
+    >>> thread.join()
+    >>> ex.conn.close()
+    """
+
+    def __init__(self, factory, size, lock=None):
+        self._factory = factory
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._shared_lock = lock
+
+    @contextmanager
+    def executor(self):
+        """Borrow an executor for the duration of the context."""
+        with self._slots:
+            with self._lock:
+                executor = self._idle.pop() if self._idle else None
+            if executor is None:
+                executor = self._factory()
+            if self._shared_lock is not None:
+                self._shared_lock.acquire()
+            try:
+                yield executor
+            finally:
+                if self._shared_lock is not None:
+                    self._shared_lock.release()
+                with self._lock:
+                    self._idle.append(executor)
+
+    def close(self):
+        """Close the connections of the idle executors."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for executor in idle:
+            executor.conn.close()
+
 
 class SQLExecute(object):
 
@@ -30,32 +219,217 @@ class SQLExecute(object):
         ORDER BY 1
     '''
 
-    table_columns_query = '''
-        SELECT name, sql
-        FROM sqlite_master
-        WHERE type IN ('table','view')
-        AND name NOT LIKE 'sqlite_%'
-        ORDER BY 1
+    schema_objects_query = '''
+        SELECT type, name, tbl_name, sql
+        FROM {schema}.sqlite_master
+        WHERE type IN ('table', 'view', 'index', 'trigger')
+        AND (type = 'index' OR name NOT LIKE 'sqlite_%')
+        ORDER BY 1, 2
     '''
 
-    def __init__(self, filename):
-        if filename:
-            self.filename = os.path.expanduser(os.path.abspath(filename))
+    # The table-valued pragma functions let a single query return the columns
+    # of every table. table_xinfo also reports hidden and generated columns
+    # (SQLite 3.26+), table_info works from SQLite 3.16.
+    columns_query = '''
+        SELECT m.name, c.name, c.type, c."notnull", c.dflt_value, c.pk, {hidden}
+        FROM {schema}.sqlite_master AS m
+        JOIN pragma_{pragma}(m.name, ?) AS c
+        WHERE m.type IN ('table', 'view')
+        AND m.name NOT LIKE 'sqlite_%'
+        ORDER BY m.name, c.cid
+    '''
+
+    index_columns_query = '''
+        SELECT m.name, i.name
+        FROM {schema}.sqlite_master AS m
+        JOIN pragma_index_info(m.name, ?) AS i
+        WHERE m.type = 'index'
+        ORDER BY m.name, i.seqno
+    '''
+
+    # Number of read-only connections of the pool.
+    pool_size = 4
+
+    def __init__(self, filename, check_same_thread=True, cached_statements=100,
+                 isolation_level=None, detect_types=0, uri=False,
+                 read_only=False, database=None):
+        """
+        The keyword arguments are passed on to sqlite3.connect(). Like the
+        sqlite3 shell, the connection is in autocommit mode unless an
+        isolation level is given, so explicit BEGIN and COMMIT statements
+        (as found in dumps) behave as written, and changes aren't silently
+        rolled back when the client exits.
+
+        A *read_only* executor can't change the database. *database* is the
+        name or URI the connection is opened with, if it isn't *filename*.
+        """
+        if uri or filename == ':memory:':
+            self.filename = filename
+        elif filename:
+            self.filename = os.path.abspath(os.path.expanduser(filename))
         else:
             self.filename = ':memory:'
-        self.dbname = 'dummy'
+        self.dbname = 'main'
+        self.check_same_thread = check_same_thread
+        self.read_only = read_only
+        self.connect_options = {'cached_statements': cached_statements,
+                                'isolation_level': isolation_level,
+                                'detect_types': detect_types}
+        if uri:
+            # Only pass it when needed, Python 2 doesn't know it.
+            self.connect_options['uri'] = True
+
+        self.database = database or self.filename
+        if database is None and self.filename == ':memory:' and URI_SUPPORTED:
+            # Open the in-memory database with a shared cache, so that the
+            # connections of the pool see the same database.
+            self.database = 'file:sqlitecli-memory-{0}-{1}?{2}'.format(
+                os.getpid(), next(_memory_databases),
+                'mode=memory&cache=shared')
+            self.connect_options['uri'] = True
+
+        # On a shared cache, a statement that changes a table (or the schema)
+        # another connection is reading fails at once with 'database table is
+        # locked' rather than waiting for it. The statements of the user and
+        # the reads of the pool are serialized, so background work never
+        # makes a statement of the user fail.
+        self.shared_cache = 'cache=shared' in self.database
+        self.lock = threading.RLock()
+
+        # Read-only executors for background work, none for read-only
+        # executors themselves.
+        self.pool = None
+        if not read_only:
+            self.pool = ConnectionPool(
+                self.read_only_executor, self.pool_size,
+                lock=self.lock if self.shared_cache else None)
+        # Schema catalogs, keyed by schema name.
+        self.catalogs = {}
         self.connect()
 
+    def read_only_executor(self, filename=None):
+        """Return a new read-only executor of the database, or of the
+        database *filename* (e.g. one attached to it), that can be used by
+        any thread.
+
+        Without URI support, a read-only executor of an in-memory database
+        sees an empty database of its own.
+        """
+        if filename is None:
+            filename, database = self.filename, self.database
+        else:
+            database = None
+        return SQLExecute(filename, check_same_thread=False, read_only=True,
+                          database=database, **self.connect_options)
+
+    def _connect_target(self):
+        """Return the name or URI to open the connection with."""
+        database = self.database
+        if not self.read_only or database == ':memory:':
+            return database
+        if database.startswith('file:'):
+            if 'mode=' in database:
+                return database
+            return database + ('&' if '?' in database else '?') + 'mode=ro'
+        if URI_SUPPORTED:
+            from urllib.request import pathname2url
+            return 'file:{0}?mode=ro'.format(pathname2url(database))
+        if not os.path.exists(database):
+            # Like mode=ro, don't create it.
+            raise sqlite3.OperationalError('unable to open database file')
+        return database
+
     def connect(self):
-        conn = sqlite3.connect(self.filename)
+        if self.pool is not None:
+            # They'd keep a shared in-memory database alive.
+            self.pool.close()
+        if self.filename == ':memory:' and hasattr(self, 'conn'):
+            # Start over with an empty database, the last connection to a
+            # shared in-memory database closes it.
+            self.conn.close()
+        options = dict(self.connect_options)
+        target = self._connect_target()
+        if target.startswith('file:') and URI_SUPPORTED:
+            options['uri'] = True
+        conn = sqlite3.connect(target, factory=Connection,
+                               check_same_thread=self.check_same_thread,
+                               **options)
+        if self.read_only:
+            # Also covers the databases that aren't opened with mode=ro.
+            conn.execute('PRAGMA query_only = ON')
+            # Don't wait for the table locks of other connections to a
+            # shared cache, e.g. while the user has a transaction open.
+            conn.execute('PRAGMA read_uncommitted = ON')
         if hasattr(self, 'conn'):
             self.conn.close()
+        conn.executor = weakref.ref(self)
         self.conn = conn
 
-    def run(self, statement):
+    # Number of virtual machine instructions between calls of the progress
+    # handler installed by cancellable().
+    progress_steps = 100000
+
+    @contextmanager
+    def cancellable(self, progress=None):
+        """Make SIGINT (Ctrl-C) interrupt the statements run in this context.
+
+        A blocking sqlite3 call doesn't let Python signal handlers run, so a
+        progress handler is installed while the context is active: it runs
+        every `progress_steps` virtual machine instructions, and when SIGINT
+        arrived meanwhile it makes the statement fail with an 'interrupted'
+        OperationalError. Outside of sqlite3 calls (e.g. while the rows are
+        printed), SIGINT raises KeyboardInterrupt as usual.
+
+        Connection.interrupt() isn't used: its flag stays set while any
+        statement is open, e.g. the cursor of a result that was being
+        printed, and would make the next statements fail too.
+
+        :param progress: Called with the number of virtual machine steps and
+                         the seconds elapsed since the context was entered.
+        """
+        conn = self.conn
+        start = time()
+        steps = [0]
+        cancelled = [False]
+
+        def on_sigint(signum, frame):
+            while frame is not None:
+                if frame.f_code is on_progress.__code__:
+                    # Inside a statement, let on_progress() abort it.
+                    cancelled[0] = True
+                    return
+                frame = frame.f_back
+            raise KeyboardInterrupt()
+
+        def on_progress():
+            steps[0] += self.progress_steps
+            if progress is not None:
+                progress(steps[0], time() - start)
+            # A non-zero value aborts the statement.
+            abort, cancelled[0] = cancelled[0], False
+            return abort
+
+        try:
+            previous = signal.signal(signal.SIGINT, on_sigint)
+        except ValueError:
+            # Signal handlers can only be installed in the main thread.
+            previous = None
+        conn.set_progress_handler(on_progress, self.progress_steps)
+        try:
+            yield
+        finally:
+            conn.set_progress_handler(None, 0)
+            if previous is not None:
+                signal.signal(signal.SIGINT, previous)
+
+    def run(self, statement, profiles=None):
         """Execute the sql in the database and return the results. The results
         are a list of tuples. Each tuple has 4 values
         (title, rows, headers, status).
+
+        If a list is passed as *profiles*, a StatementProfile timing the
+        splitting and execution is appended to it for every statement, before
+        its result is yielded.
         """
 
         # Remove spaces and EOL
@@ -63,27 +437,78 @@ class SQLExecute(object):
         if not statement:  # Empty string
             yield (None, None, None, None)
 
-        # Split the sql into separate queries and run each one.
-        # Unless it's saving a favorite query, in which case we
-        # want to save them all together.
-        if statement.startswith('\\fs'):
-            components = [statement]
-        else:
-            components = sqlparse.split(statement)
+        profile = None
+        if profiles is not None:
+            profile = StatementProfile(statement)
+        with timed(profile, 'split'):
+            # Split the sql into separate queries and run each one.
+            # Unless it's saving a favorite query, in which case we
+            # want to save them all together.
+            if statement.startswith('\\fs'):
+                components = [statement]
+            else:
+                components = split_statements(statement)
 
         for sql in components:
             # Remove spaces, eol and semi-colons.
             sql = sql.rstrip(';')
+            if profiles is not None:
+                # The first statement is charged with splitting the input.
+                if profile is None:
+                    profile = StatementProfile(sql)
+                profile.statement = sql
+                profiles.append(profile)
 
             cur = self.conn.cursor()
             try:   # Special command
                 _logger.debug('Trying a dbspecial command. sql: %r', sql)
-                for result in special.execute(cur, sql):
+                with timed(profile, 'execute'), self.lock:
+                    results = special.execute(cur, sql)
+                for result in results:
                     yield result
             except special.CommandNotFound:  # Regular SQL
                 _logger.debug('Regular sql statement. sql: %r', sql)
-                cur.execute(sql)
+                with timed(profile, 'execute'):
+                    self._execute(cur, sql)
                 yield self.get_result(cur)
+            profile = None
+
+    def run_batch(self, statement):
+        """Execute a single complete *statement* of a script and return its
+        results, like run() yields them.
+
+        The statements of a script have already been split by
+        iter_statements(), and most of them return no rows (e.g. the INSERTs
+        of a dump), so unless it's a special command the statement isn't
+        split again, nor parsed, timed and logged like run() does. Only
+        results with rows are returned.
+        """
+        sql = statement.strip().rstrip(';')
+        if not sql:
+            return []
+        if special.is_special_command(sql):
+            return list(self.run(sql))
+
+        cur = self.conn.cursor()
+        self._execute(cur, sql)
+        if cur.description is None:
+            return []
+        return [self.get_result(cur)]
+
+    def _execute(self, cur, sql):
+        """Execute the statement *sql* of the user on *cur*, counting it in
+        the statistics and the statement cache of the connection."""
+        conn = self.conn
+        conn.statement_cache.record(sql)
+        start = time()
+        if self.shared_cache:
+            with self.lock:
+                cur.execute(sql)
+        else:
+            # Nothing to wait for, skip the lock on the path of batches.
+            cur.execute(sql)
+        conn.queries += 1
+        conn.execute_time += time() - start
 
     def get_result(self, cursor):
         """Get the current result's data from the cursor."""
@@ -109,14 +534,156 @@ class SQLExecute(object):
 
     def table_columns(self):
         """Yields (table column) pairs"""
-        for table, sql in self.conn.execute(self.table_columns_query):
-            for col in self._get_cols(sql):
-                yield (table, col)
+        catalog = self.schema_catalog()
+        for kind in ('tables', 'views'):
+            for table, columns in sorted(catalog[kind].items()):
+                for column in columns:
+                    yield (table, column.name)
 
-    def _get_cols(self, sql):
-        index = sql.index('(')
-        return [col.split()[0] for col in sql[index + 1: len(sql) - 1].split(', ')]
+    def schema_version(self, schema='main'):
+        """Return the schema version of *schema*.
+
+        SQLite increments it whenever the schema changes, whichever connection
+        made the change.
+        """
+        query = 'PRAGMA {0}.schema_version'.format(quote_identifier(schema))
+        return self.conn.execute(query).fetchone()[0]
+
+    def schema_catalog(self, schema='main'):
+        """Introspect the tables, views, indexes and triggers of *schema*.
+
+        Returns a dict with these keys:
+        * 'version': the schema version the catalog was read at
+        * 'sql': {name: CREATE statement} for tables and views
+        * 'tables' and 'views': {name: [Column, ...]}
+        * 'indexes': {name: Index}
+        * 'triggers': {name: table name}
+
+        Catalogs are cached per schema. As long as the schema version doesn't
+        change the cached catalog is returned as is. Otherwise only the tables
+        whose CREATE statement changed are introspected again (views are
+        always re-read, since their columns depend on other tables), and the
+        column lists of the other tables are shared with the previous catalog.
+        """
+        version = self.schema_version(schema)
+        previous = self.catalogs.get(schema)
+        if previous is not None and previous['version'] == version:
+            return previous
+
+        catalog = {'version': version, 'sql': {}, 'tables': {}, 'views': {},
+                   'indexes': {}, 'triggers': {}}
+        query = self.schema_objects_query.format(
+            schema=quote_identifier(schema))
+        for kind, name, table, sql in self.conn.execute(query):
+            if kind in ('table', 'view'):
+                catalog['sql'][name] = sql
+                catalog[kind + 's'][name] = None
+            elif kind == 'index':
+                catalog['indexes'][name] = Index(name, table, [])
+            else:
+                catalog['triggers'][name] = table
+
+        if previous is None:
+            # Nothing to reuse, read all the columns in one go.
+            columns = self._all_columns(schema)
+        else:
+            columns = {}
+            for name in catalog['tables']:
+                if (name in previous['tables'] and
+                        previous['sql'].get(name) == catalog['sql'][name]):
+                    columns[name] = previous['tables'][name]
+
+        for kind in ('tables', 'views'):
+            for name in catalog[kind]:
+                if name not in columns:
+                    columns[name] = self._relation_columns(name, schema)
+                catalog[kind][name] = columns[name]
+
+        for name, column in self._index_columns(schema, catalog['indexes']):
+            catalog['indexes'][name].columns.append(column)
+
+        self.catalogs[schema] = catalog
+        return catalog
+
+    def _all_columns(self, schema):
+        """Return {relation: [Column, ...]} for every table and view.
+
+        An empty dict is returned if the columns can't be read with a single
+        query, e.g. because a view refers to a table that has been dropped.
+        """
+        version = sqlite3.sqlite_version_info
+        if version < (3, 16, 0):
+            return {}
+
+        if version >= (3, 26, 0):
+            pragma, hidden = 'table_xinfo', 'c.hidden'
+        else:
+            pragma, hidden = 'table_info', '0'
+        query = self.columns_query.format(schema=quote_identifier(schema),
+                                          pragma=pragma, hidden=hidden)
+        columns = {}
+        try:
+            for row in self.conn.execute(query, (schema, )).fetchall():
+                columns.setdefault(row[0], []).append(Column(*row[1:]))
+        except sqlite3.OperationalError as e:
+            _logger.debug('Reading the columns one relation at a time: %s', e)
+            return {}
+        return columns
+
+    def _relation_columns(self, name, schema):
+        """Return the columns of the table or view *name*."""
+        if sqlite3.sqlite_version_info >= (3, 26, 0):
+            pragma = 'table_xinfo'
+        else:
+            pragma = 'table_info'
+        query = 'PRAGMA {0}.{1}({2})'.format(
+            quote_identifier(schema), pragma, quote_identifier(name))
+        try:
+            rows = self.conn.execute(query).fetchall()
+        except sqlite3.OperationalError as e:
+            _logger.debug('Unable to read the columns of %r: %s', name, e)
+            return []
+        return [Column(*(row[1:6] + (row[6] if len(row) > 6 else 0, )))
+                for row in rows]
+
+    def declared_types(self, statement, headers):
+        """Return the declared type of each of the *headers* of the result of
+        *statement*, or None if it doesn't read from a single table.
+
+        The type is None for the headers that aren't columns of the table,
+        e.g. expressions.
+        """
+        tables = extract_tables(statement)
+        if len(tables) != 1:
+            return None
+        schema, table, _ = tables[0]
+        columns = dict((column.name.lower(), column.type) for column in
+                       self._relation_columns(table, schema or 'main'))
+        return [columns.get(header.lower()) for header in headers]
+
+    def _index_columns(self, schema, indexes):
+        """Yields (index, column name) pairs for every index in *indexes*."""
+        quoted_schema = quote_identifier(schema)
+        if sqlite3.sqlite_version_info >= (3, 16, 0):
+            query = self.index_columns_query.format(schema=quoted_schema)
+            for row in self.conn.execute(query, (schema, )):
+                yield row
+            return
+
+        for name in indexes:
+            query = 'PRAGMA {0}.index_info({1})'.format(
+                quoted_schema, quote_identifier(name))
+            for row in self.conn.execute(query):
+                yield name, row[2]
 
     def databases(self):
         for row in self.conn.execute(self.databases_query):
             yield row[1]
+
+    def attached_databases(self):
+        """Return the (name, filename) pairs of the attached databases, i.e.
+        of all the databases but main and temp. The filename is empty for
+        in-memory and temporary databases."""
+        return [(row[1], row[2])
+                for row in self.conn.execute(self.databases_query)
+                if row[1] not in ('main', 'temp')]